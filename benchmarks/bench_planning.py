@@ -0,0 +1,200 @@
+"""番組表の解析から録音計画作成までの各段階を合成データで計測する
+
+    uv run python benchmarks/bench_planning.py --stations 8 --per-day 40 --words 100 --titles 150
+    uv run python benchmarks/bench_planning.py --save benchmarks/baseline.json
+    uv run python benchmarks/bench_planning.py --compare benchmarks/baseline.json
+
+--compare では保存した基準値と比べ、時間が --threshold(%) を超えて悪化した段階があれば終了コード1を返す。
+基準値はマシンに依存するため各自のマシンで作成する（benchmarks/baseline.json は .gitignore 済み）。
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import patch
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from radiko import Radiko  # noqa: E402
+
+
+MODES = ['contains', 'exact', 'prefix', 'regex']
+WEEKDAYS = ['月曜日', '火曜日', '水曜日', '木曜日', '金曜日', '土曜日', '日曜日']
+PERFORMERS = ['オードリー', '三四郎', '千鳥', 'ナイツ', 'さまぁ～ず', 'U字工事', '銀シャリ', 'チュートリアル']
+GENRES = ['ラジオ', 'オールナイトニッポン', 'ミュージック', 'ニュース', 'スポーツ', 'ナイト', 'サタデー', 'ＳＵＮＤＡＹ']
+
+
+def synthetic_titles(count: int, rng: random.Random) -> list[str]:
+    titles = []
+    for i in range(count):
+        performer = rng.choice(PERFORMERS)
+        genre = rng.choice(GENRES)
+        titles.append(f'{performer}の{genre}　{i}')
+    return titles
+
+
+def synthetic_weekly_xml(station: str, titles: list[str], per_day: int, start: datetime, days: int,
+                         rng: random.Random) -> str:
+    """1局分の週間番組表XML。1日を per_day 枠に等分し、タイトルをランダムに割り当てる"""
+    slot = timedelta(seconds=24 * 60 * 60 // per_day)
+    progs = []
+    for day in range(days):
+        ft = start + timedelta(days=day)
+        for _ in range(per_day):
+            to = ft + slot
+            title = rng.choice(titles)
+            if rng.random() < 0.1:
+                title += f' 第{rng.randint(1, 300)}回'
+            pfm = rng.choice(PERFORMERS) if rng.random() < 0.5 else ''
+            progs.append(
+                f'<prog ft="{ft:%Y%m%d%H%M%S}" to="{to:%Y%m%d%H%M%S}" dur="{slot.seconds}">'
+                f'<title>{escape(title)}</title><pfm>{escape(pfm)}</pfm>'
+                f'<img>https://example.com/{station}.jpg</img><info>{"x" * 200}</info></prog>'
+            )
+            ft = to
+    return (f'<?xml version="1.0" encoding="UTF-8"?><radiko><stations><station id="{station}">'
+            f'<name>{station}</name><progs>{"".join(progs)}</progs></station></stations></radiko>')
+
+
+def synthetic_radio(stations: list[str], titles: list[str], words: int, title_rules: int,
+                    rng: random.Random) -> list:
+    """words 個の検索ワード（全一致方法に分散）と title_rules 個の番組決め打ちルール"""
+    words_by_mode: dict[str, list[str]] = {mode: [] for mode in MODES}
+    for i in range(words):
+        mode = MODES[i % len(MODES)]
+        base = rng.choice(titles)
+        performer, rest = base.split('の', 1)
+        if mode == 'contains':
+            word = rest
+        elif mode == 'prefix':
+            word = base
+        elif mode == 'regex':
+            word = f'^{performer}の.*{rest.split("　")[1]}$'
+        else:
+            word = base
+        words_by_mode[mode].append(word)
+    radio = [{'words_by_mode': words_by_mode, 'stations': stations}]
+    for i in range(title_rules):
+        title = rng.choice(titles)
+        rule = {
+            'station': rng.choice(stations),
+            'radiko_title': title,
+            'title_match_mode': rng.choice(['prefix', 'contains']),
+            'artist': '{pfm}',
+            'album': title,
+            'title': '%Y-%m-%d',
+            'filename': f'rule{i}_%Y%m%d',
+            'storage_dir': '{album}/%Y',
+        }
+        if rng.random() < 0.3:
+            rule['radiko_dayw'] = rng.choice(WEEKDAYS)
+        radio.append(rule)
+    return radio
+
+
+def measure(func, repeat: int) -> dict:
+    """最速の実行時間と、1回分のピークメモリ(tracemalloc)を返す"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': best, 'peak_kib': peak / 1024, 'result': result}
+
+
+def run(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    stations = [f'ST{i:02d}' for i in range(args.stations)]
+    titles = synthetic_titles(args.title_pool, rng)
+    start = datetime(2026, 3, 23, 5, 0)
+    xmls = {station: synthetic_weekly_xml(station, titles, args.per_day, start, 7, rng) for station in stations}
+    radio = synthetic_radio(stations, titles, args.words, args.titles, rng)
+
+    radiko = Radiko(Path('rec.sh'), '', '', Path('/tmp'), Path('/tmp/storage'))
+    radiko.key_strip_regex = radiko._key_strip_regex_config(radio)
+    replace_config = radiko._replace_config(radio)
+    word_rules = [rule for cf in radio if 'words_by_mode' in cf for rule in radiko._word_match_rules(cf)]
+
+    stages = {}
+    stages['parse'] = measure(
+        lambda: {station: radiko._parse_programs_xml(xml, replace_config) for station, xml in xmls.items()},
+        args.repeat)
+    parsed = stages['parse']['result']
+    stages['filter'] = measure(
+        lambda: {station: radiko._filter_programs(progs, radio) for station, progs in parsed.items()}, args.repeat)
+    all_programs = [pg for progs in parsed.values() for pg in progs]
+    stages['split_by_gap'] = measure(lambda: radiko._split_programs_by_gap(all_programs), args.repeat)
+    filtered = [program for progs in stages['filter']['result'].values() for program in progs.values()]
+    stages['dedupe_key'] = measure(
+        lambda: [radiko._dedupe_key(program, word_rules) for program in filtered], args.repeat)
+    with patch.object(Radiko, '_get_programs_xml', lambda self, station: xmls[station]):
+        stages['get_programs'] = measure(lambda: radiko.get_programs(radio), args.repeat)
+
+    return {
+        'params': {key: getattr(args, key) for key in ('stations', 'per_day', 'words', 'titles', 'title_pool', 'seed')},
+        'counts': {'programs': len(all_programs), 'matched': len(filtered),
+                   'planned': len(stages['get_programs']['result'])},
+        'stages': {name: {'seconds': stage['seconds'], 'peak_kib': stage['peak_kib']} for name, stage in stages.items()},
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> bool:
+    ok = True
+    if baseline.get('params') != report['params']:
+        print('warning: baseline was measured with different parameters')
+    for name, stage in report['stages'].items():
+        base = baseline['stages'].get(name)
+        if not base:
+            continue
+        change = (stage['seconds'] / base['seconds'] - 1) * 100 if base['seconds'] else 0.0
+        mark = ''
+        if change > threshold:
+            mark = '  << regression'
+            ok = False
+        print(f'{name:14s} {base["seconds"] * 1000:9.1f} ms -> {stage["seconds"] * 1000:9.1f} ms ({change:+6.1f}%){mark}')
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stations', type=int, default=8)
+    parser.add_argument('--per-day', type=int, default=40)
+    parser.add_argument('--words', type=int, default=100)
+    parser.add_argument('--titles', type=int, default=150)
+    parser.add_argument('--title-pool', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', type=Path, help='結果を基準値として保存するJSONファイル')
+    parser.add_argument('--compare', type=Path, help='比較する基準値のJSONファイル')
+    parser.add_argument('--threshold', type=float, default=20.0, help='悪化とみなす時間の増加率(%%)')
+    args = parser.parse_args()
+
+    # 番組ごとの INFO ログが計測結果に混ざらないようにする
+    logging.disable(logging.INFO)
+    report = run(args)
+    print(f'programs={report["counts"]["programs"]} matched={report["counts"]["matched"]} '
+          f'planned={report["counts"]["planned"]}')
+    for name, stage in report['stages'].items():
+        print(f'{name:14s} {stage["seconds"] * 1000:9.1f} ms  peak {stage["peak_kib"]:9.1f} KiB')
+
+    if args.save:
+        args.save.write_text(json.dumps(report, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+        print(f'saved baseline to {args.save}')
+    if args.compare:
+        return 0 if compare(report, json.loads(args.compare.read_text(encoding='utf-8')), args.threshold) else 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""rec_radiko_pg の import 時間を -X importtime で計測し、予算を超えていないか確認する
+
+    uv run python benchmarks/import_time.py [--budget-ms 250] [--top 15]
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+BUDGET_FILE = Path(__file__).resolve().parent / 'import_budget.json'
+
+# 録音・メール送信の経路でのみ読み込むモジュール。起動時に読み込まれていたら失敗とする
+LAZY_MODULES = ('mutagen', 'smtplib', 'email.mime', 'gmail', 'dotenv', 'radiko.audio_concatenator')
+
+
+def measure(module: str = 'rec_radiko_pg', runs: int = 5) -> tuple[float, list[tuple[int, int, str]], set[str]]:
+    """import を runs 回計測し、最小の累積時間(ms)とその回のモジュール別内訳を返す"""
+    best = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        )
+        rows = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+        total = next(cumulative for _, cumulative, name in rows if name.strip() == module)
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+    return total / 1000, rows, {name.strip() for _, _, name in rows}
+
+
+def main() -> int:
+    budget = json.loads(BUDGET_FILE.read_text(encoding='utf-8'))
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget-ms', type=float, default=budget['rec_radiko_pg_ms'])
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    total_ms, rows, modules = measure()
+    print(f'rec_radiko_pg import: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)')
+    for self_us, cumulative_us, name in sorted(rows, key=lambda row: row[1], reverse=True)[:args.top]:
+        print(f'  {cumulative_us / 1000:8.1f} ms  {self_us / 1000:6.1f} ms  {name}')
+
+    ok = True
+    loaded = sorted(m for m in modules if any(m == lazy or m.startswith(lazy + '.') for lazy in LAZY_MODULES))
+    if loaded:
+        print(f'NG: lazy modules imported at startup: {", ".join(loaded)}')
+        ok = False
+    if total_ms > args.budget_ms:
+        print(f'NG: import time {total_ms:.1f} ms exceeds budget {args.budget_ms:.0f} ms')
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
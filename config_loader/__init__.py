@@ -3,16 +3,17 @@ import yaml
 from pathlib import Path
 from dataclasses import fields
 from logging import getLogger
-from dotenv import load_dotenv
 
 
-load_dotenv()
 logger = getLogger(__name__)
 
 
 class ConfigLoader:
     @staticmethod
     def load(config_yml: Path, Config) -> dict:
+        from dotenv import load_dotenv
+
+        load_dotenv()
         with open(config_yml, encoding='utf-8') as file:
             config = Config(**yaml.safe_load(file))
             for member in fields(Config):
@@ -22,5 +23,14 @@ class ConfigLoader:
                     setattr(config, member.name, os.environ[member.name.upper()])
                 if member.type == Path:
                     setattr(config, member.name, Path(getattr(config, member.name)))
+                elif member.type in (int, float, bool) and isinstance(getattr(config, member.name), str):
+                    setattr(config, member.name, ConfigLoader._cast(member.type, getattr(config, member.name)))
 
         return config
+
+    @staticmethod
+    def _cast(member_type: type, value: str):
+        # 環境変数は文字列で渡されるため、Config の型に合わせて変換する
+        if member_type is bool:
+            return value.strip().lower() in ('1', 'true', 'yes', 'on')
+        return member_type(value)
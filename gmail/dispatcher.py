@@ -0,0 +1,192 @@
+import json
+import os
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from logging import getLogger
+from pathlib import Path
+from metrics import phase
+from radiko._fs import write_atomic
+
+
+logger = getLogger(__name__)
+
+
+class MailDispatcher:
+    """メールをバックグラウンドで送る
+
+    send() は送信内容をディスク(spool_dir)に書いてすぐ戻る。送信スレッドはログイン済みの SMTP 接続を使い回し、
+    digest_seconds の間に届いた通知を1通にまとめて送る。失敗したら間隔を延ばしながら再送し、
+    送れなかった分は次回起動時に送る。
+    """
+
+    RETRY_SECONDS = 30.0
+    MAX_BACKOFF_SECONDS = 30 * 60.0
+    IDLE_SECONDS = 5 * 60.0
+
+    def __init__(self, gmail_sender: str, gmail_pw: str, gmail_receiver: str, spool_dir: Path,
+                 digest_seconds: float = 60.0, host: str = 'smtp.gmail.com', port: int = 587, starttls: bool = True,
+                 timeout: float = 30.0, retry_seconds: float = RETRY_SECONDS,
+                 max_backoff: float = MAX_BACKOFF_SECONDS, idle_seconds: float = IDLE_SECONDS):
+        self.gmail_sender = gmail_sender
+        self.gmail_pw = gmail_pw
+        self.gmail_receiver = gmail_receiver
+        self.spool_dir = Path(spool_dir)
+        self.digest_seconds = digest_seconds
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.timeout = timeout
+        self.retry_seconds = retry_seconds
+        self.max_backoff = max_backoff
+        self.idle_seconds = idle_seconds
+        self._cond = threading.Condition()
+        self._pending: list[dict] = []
+        self._closing = False
+        self._smtp: smtplib.SMTP | None = None
+        self._seq = 0
+        self._thread: threading.Thread | None = None
+        if self.enabled:
+            self._pending.extend(self._load_spool())
+            self._thread = threading.Thread(target=self._run, name='mail-dispatcher', daemon=True)
+            self._thread.start()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.gmail_sender and self.gmail_pw and self.gmail_receiver)
+
+    def send(self, subject: str, body: str) -> bool:
+        if not self.enabled:
+            return False
+        message = self._spool(subject, body)
+        with self._cond:
+            self._pending.append(message)
+            self._cond.notify()
+        return True
+
+    def close(self, timeout: float = 60.0) -> None:
+        """ダイジェストを待たずに残りを送って終了する。送れなかった分はスプールに残る"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning('mail dispatcher did not finish in time; unsent mail stays in the spool')
+
+    def _spool(self, subject: str, body: str) -> dict:
+        with self._cond:
+            self._seq += 1
+            seq = self._seq
+        message = {'subject': subject, 'body': body, 'queued_at': time.time()}
+        path = self.spool_dir / f'{time.time_ns()}-{os.getpid()}-{seq}.json'
+        write_atomic(path, json.dumps(message, ensure_ascii=False))
+        return {**message, 'path': path}
+
+    def _load_spool(self) -> list[dict]:
+        messages = []
+        for path in sorted(self.spool_dir.glob('*.json')):
+            try:
+                message = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError) as e:
+                logger.warning(f'skipping broken mail spool {path}: {e}')
+                continue
+            messages.append({**message, 'path': path})
+        if messages:
+            logger.info(f'resending {len(messages)} spooled mail(s)')
+        return messages
+
+    def _run(self) -> None:
+        failures = 0
+        while True:
+            with self._cond:
+                if not self._pending and not self._closing:
+                    self._cond.wait(self.idle_seconds)
+                idle = not self._pending and not self._closing
+            if idle:
+                # quit() は待たされることがあるため、send() を止めないようロックの外で切断する
+                self._disconnect()
+                continue
+            with self._cond:
+                if not self._pending:
+                    break
+                # 最初の通知から digest_seconds の間に届いたものをまとめる
+                deadline = self._pending[0]['queued_at'] + self.digest_seconds
+                while not self._closing and time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+                batch = list(self._pending)
+
+            try:
+                self._deliver(batch)
+            except (smtplib.SMTPException, OSError) as e:
+                self._disconnect()
+                failures += 1
+                if self._closing:
+                    logger.warning(f'failed to send mail, kept {len(batch)} in spool: {e}')
+                    break
+                delay = min(self.max_backoff, self.retry_seconds * 2 ** (failures - 1))
+                logger.warning(f'failed to send mail, retrying in {delay:.0f}s: {e}')
+                with self._cond:
+                    self._cond.wait_for(lambda: self._closing, delay)
+                continue
+
+            failures = 0
+            with self._cond:
+                del self._pending[:len(batch)]
+            for message in batch:
+                message['path'].unlink(missing_ok=True)
+        self._disconnect()
+
+    def _compose(self, batch: list[dict]) -> tuple[str, str]:
+        if len(batch) == 1:
+            return batch[0]['subject'], batch[0]['body']
+        subject = f'{batch[0]["subject"]} ほか ({len(batch)}件)'
+        body = '<hr>'.join(f'<b>{message["subject"]}</b><br>{message["body"]}' for message in batch)
+        return subject, body
+
+    def _connect(self) -> smtplib.SMTP:
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            try:
+                smtp.ehlo()
+                if self.starttls:
+                    smtp.starttls()
+                    smtp.ehlo()
+                smtp.login(self.gmail_sender, self.gmail_pw)
+            except BaseException:
+                smtp.close()
+                raise
+            self._smtp = smtp
+        return self._smtp
+
+    def _disconnect(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def _deliver(self, batch: list[dict]) -> None:
+        subject, body = self._compose(batch)
+        message = MIMEMultipart()
+        message["From"] = self.gmail_sender
+        message["To"] = self.gmail_receiver
+        message["Subject"] = subject
+        message.attach(MIMEText(body, 'html'))
+
+        with phase('mail'):
+            # 使い回した接続がサーバ側で切られていたら、1度だけ接続し直す
+            reused = self._smtp is not None
+            try:
+                self._connect().sendmail(self.gmail_sender, self.gmail_receiver, message.as_string())
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if not reused:
+                    raise
+                self._connect().sendmail(self.gmail_sender, self.gmail_receiver, message.as_string())
+        logger.info(f'sent mail: {subject}')
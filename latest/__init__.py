@@ -1,34 +1,42 @@
-import yaml
 from pathlib import Path
+from metrics import phase
 from radiko import Program
-import jaconv
+from .state_store import SqliteStateStore, YamlStateStore
 
 
 class Latest:
-    def __init__(self, last_record_at_filename: Path):
+    SQLITE_SUFFIXES = ('.sqlite3', '.sqlite', '.db')
+
+    def __init__(self, last_record_at_filename: Path, import_from: Path | None = None):
         self.last_record_at_filename = last_record_at_filename
-        self.last_record_at = {}
-        self.load()
+        # 拡張子で保存形式を切り替える（.yaml は従来形式、.sqlite3 等は録音履歴付きのSQLite）
+        if last_record_at_filename.suffix in self.SQLITE_SUFFIXES:
+            self.store = SqliteStateStore(last_record_at_filename, import_from)
+        else:
+            self.store = YamlStateStore(last_record_at_filename)
+
+    def _key(self, program: Program) -> str:
+        return program.series_key if program.series_key else program.title_key
 
     def load(self) -> None:
-        data = {}
-        try:
-            with open(self.last_record_at_filename, 'r', encoding='utf-8') as file:
-                preload = yaml.safe_load(file)
-                if preload:
-                    data = {jaconv.z2h(key, kana=False, ascii=True, digit=True): value for key, value in preload.items()}
-        except FileNotFoundError:
-            pass
-        self.last_record_at = data
+        self.store.load()
 
     def save(self) -> None:
-        with open(self.last_record_at_filename, 'w', encoding='utf-8') as file:
-            yaml.dump(self.last_record_at, file, allow_unicode=True)
+        with phase('state_save'):
+            self.store.save()
 
     def set(self, program: Program) -> None:
-        key = program.series_key if program.series_key else program.title_key
-        self.last_record_at[key] = program.start_time
+        with phase('state_update', station=program.station, program=program.radiko_title):
+            self.store.add(self._key(program), {
+                'start_time': program.start_time,
+                'station': program.station,
+                'end_time': program.end_time,
+                'filepath': program.filepath,
+                'filehash': program.filehash,
+            })
 
     def get(self, program: Program) -> str:
-        key = program.series_key if program.series_key else program.title_key
-        return self.last_record_at.get(key, '')
+        return self.store.get(self._key(program))
+
+    def history(self, program: Program) -> list[dict]:
+        return self.store.history(self._key(program))
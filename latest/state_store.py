@@ -0,0 +1,132 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import jaconv
+import yaml
+
+
+def _normalize_key(key: str) -> str:
+    return jaconv.z2h(key, kana=False, ascii=True, digit=True)
+
+
+class YamlStateStore:
+    """番組ごとの最終録音開始時刻を1つのYAMLファイルに保存する（従来形式）"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.last_record_at: dict[str, str] = {}
+        self.load()
+
+    def load(self) -> None:
+        data = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                preload = yaml.safe_load(file)
+                if preload:
+                    data = {_normalize_key(key): value for key, value in preload.items()}
+        except FileNotFoundError:
+            pass
+        self.last_record_at = data
+
+    def save(self) -> None:
+        with open(self.path, 'w', encoding='utf-8') as file:
+            yaml.dump(self.last_record_at, file, allow_unicode=True)
+
+    def get(self, key: str) -> str:
+        return self.last_record_at.get(key, '')
+
+    def add(self, key: str, episode: dict) -> None:
+        # 並列録音では完了順が前後するため、より新しい開始時刻のみ記録する
+        if episode['start_time'] > self.last_record_at.get(key, ''):
+            self.last_record_at[key] = episode['start_time']
+
+    def history(self, key: str) -> list[dict]:
+        start_time = self.get(key)
+        return [{'key': key, 'start_time': start_time}] if start_time else []
+
+
+class SqliteStateStore:
+    """録音履歴をSQLite(WALモード)に1回ずつ追記する
+
+    更新は1件ずつのトランザクションで確定するため、書き込み中に落ちても既存の履歴は壊れない。
+    複数プロセスからの同時更新は SQLite のロックと busy_timeout で待ち合わせる。
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS episodes (
+            key TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            station TEXT NOT NULL DEFAULT '',
+            end_time TEXT NOT NULL DEFAULT '',
+            filepath TEXT NOT NULL DEFAULT '',
+            filehash TEXT NOT NULL DEFAULT '',
+            recorded_at REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (key, start_time)
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    '''
+
+    def __init__(self, path: Path, import_from: Path | None = None, timeout: float = 30.0):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(self.SCHEMA)
+        if import_from:
+            self._import_yaml(import_from)
+
+    def _import_yaml(self, yaml_path: Path) -> None:
+        # 旧形式の last_record_at.yaml は最初の1回だけ取り込む
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self._conn.execute("SELECT 1 FROM meta WHERE name = 'yaml_imported'").fetchone():
+                    self._conn.execute('COMMIT')
+                    return
+                legacy = YamlStateStore(yaml_path).last_record_at
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO episodes (key, start_time) VALUES (?, ?)',
+                    [(key, str(value)) for key, value in legacy.items()],
+                )
+                self._conn.execute("INSERT INTO meta (name, value) VALUES ('yaml_imported', ?)", (str(yaml_path),))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def load(self) -> None:
+        pass
+
+    def save(self) -> None:
+        pass
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            row = self._conn.execute('SELECT MAX(start_time) FROM episodes WHERE key = ?', (key,)).fetchone()
+        return row[0] or ''
+
+    def add(self, key: str, episode: dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO episodes (key, start_time, station, end_time, filepath, filehash, recorded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, episode['start_time'], episode.get('station', ''), episode.get('end_time', ''),
+                 episode.get('filepath', ''), episode.get('filehash', ''), time.time()),
+            )
+
+    def history(self, key: str) -> list[dict]:
+        with self._lock:
+            cursor = self._conn.execute(
+                'SELECT key, start_time, station, end_time, filepath, filehash, recorded_at '
+                'FROM episodes WHERE key = ? ORDER BY start_time', (key,))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from logging import getLogger
+from pathlib import Path
+
+
+logger = getLogger(__name__)
+
+
+class Metrics:
+    """処理段階ごとの所要時間と転送バイト数を集計する
+
+    各段階の終了時に JSON 1行のログを出し、集計結果は Prometheus の textfile 形式で書き出せる。
+    series_labels を指定すると、集計はそのラベルだけで行う（ログには全ラベルを出す）。
+    常駐時に番組ごとの系列が増え続けないよう、番組名などを集計から外すのに使う。
+    """
+
+    PREFIX = 'rec_radiko_pg'
+
+    def __init__(self, series_labels: tuple[str, ...] | None = None):
+        self.series_labels = series_labels
+        self._lock = threading.Lock()
+        self._phases: dict[tuple, dict] = {}
+        self._bytes: dict[tuple, int] = {}
+
+    @contextmanager
+    def phase(self, name: str, **labels: str):
+        """with 文の区間を計測する
+
+        yield した dict に bytes を入れると転送量として、status を入れると結果として記録する。
+        """
+        extra: dict = {}
+        status = 'ok'
+        started = time.perf_counter()
+        try:
+            yield extra
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, status=extra.get('status', status),
+                         bytes=extra.get('bytes'), **labels)
+
+    def _key(self, name: str, labels: dict) -> tuple:
+        if self.series_labels is not None:
+            labels = {key: value for key, value in labels.items() if key in self.series_labels}
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, seconds: float, status: str = 'ok', bytes: int | None = None, **labels: str) -> None:
+        labels = {key: str(value) for key, value in labels.items() if value is not None and value != ''}
+        key = self._key(name, labels)
+        with self._lock:
+            stat = self._phases.setdefault(key, {'sum': 0.0, 'count': 0, 'max': 0.0, 'errors': 0})
+            stat['sum'] += seconds
+            stat['count'] += 1
+            stat['max'] = max(stat['max'], seconds)
+            if status != 'ok':
+                stat['errors'] += 1
+            if bytes is not None:
+                self._bytes[key] = self._bytes.get(key, 0) + bytes
+        record = {'ts': round(time.time(), 3), 'phase': name, 'seconds': round(seconds, 6), 'status': status, **labels}
+        if bytes is not None:
+            record['bytes'] = bytes
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+    def snapshot(self) -> tuple[dict, dict]:
+        with self._lock:
+            return {key: dict(value) for key, value in self._phases.items()}, dict(self._bytes)
+
+    def _labels(self, name: str, labels: tuple) -> str:
+        def escape(value: str) -> str:
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs = [('phase', name), *labels]
+        return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in pairs) + '}'
+
+    def prometheus_text(self) -> str:
+        phases, sizes = self.snapshot()
+        p = self.PREFIX
+        lines = [
+            f'# HELP {p}_phase_seconds Time spent in each phase.',
+            f'# TYPE {p}_phase_seconds summary',
+        ]
+        for (name, labels), stat in sorted(phases.items()):
+            lines.append(f'{p}_phase_seconds_sum{self._labels(name, labels)} {stat["sum"]:.6f}')
+            lines.append(f'{p}_phase_seconds_count{self._labels(name, labels)} {stat["count"]}')
+        lines += [f'# HELP {p}_phase_max_seconds Longest single run of each phase.',
+                  f'# TYPE {p}_phase_max_seconds gauge']
+        for (name, labels), stat in sorted(phases.items()):
+            lines.append(f'{p}_phase_max_seconds{self._labels(name, labels)} {stat["max"]:.6f}')
+        lines += [f'# HELP {p}_phase_errors_total Number of failed runs of each phase.',
+                  f'# TYPE {p}_phase_errors_total counter']
+        for (name, labels), stat in sorted(phases.items()):
+            lines.append(f'{p}_phase_errors_total{self._labels(name, labels)} {stat["errors"]}')
+        lines += [f'# HELP {p}_phase_bytes_total Bytes moved in each phase.',
+                  f'# TYPE {p}_phase_bytes_total counter']
+        for (name, labels), size in sorted(sizes.items()):
+            lines.append(f'{p}_phase_bytes_total{self._labels(name, labels)} {size}')
+        lines += [f'# HELP {p}_last_run_timestamp_seconds Time the metrics were written.',
+                  f'# TYPE {p}_last_run_timestamp_seconds gauge',
+                  f'{p}_last_run_timestamp_seconds {time.time():.0f}']
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: Path) -> None:
+        # node_exporter が書きかけを読まないよう、一時ファイルから rename する
+        # radiko が metrics を読み込むため、循環しないよう使うときに読み込む
+        from radiko._fs import write_atomic
+
+        write_atomic(Path(path), self.prometheus_text())
+
+    def reset(self) -> None:
+        with self._lock:
+            self._phases.clear()
+            self._bytes.clear()
+
+
+metrics = Metrics()
+
+
+def phase(name: str, **labels: str):
+    return metrics.phase(name, **labels)
@@ -1,13 +1,33 @@
 import requests
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
-from datetime import datetime
+import io
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import calendar
+from datetime import datetime, timedelta
 from dataclasses import dataclass, replace
+from functools import lru_cache
 import shutil
+import os
+import signal
+import sys
 import subprocess
+import threading
+import time
 from logging import getLogger
 from pathlib import Path
-from mutagen.mp4 import MP4, MP4Cover
-from .audio_concatenator import AudioConcatenator
+from .schedule_cache import ScheduleCache
+from .matcher import TextMatcher
+from .plan_cache import PlanCache
+from .plan_snapshot import PlanSnapshot
+from .schedule_table import ScheduleTable
+from .artwork_cache import ArtworkCache
+from .file_mover import FileMover, MoveResult
+from .hls_downloader import AuthError, DownloadError, HlsDownloader
+from .auth import RadikoAuth
+from .recording_executor import RateLimiter, RecordingExecutor, RecordingResult
+from metrics import phase
 import jaconv
 import re
 import unicodedata
@@ -16,14 +36,38 @@ import unicodedata
 logger = getLogger(__name__)
 
 
+KEY_CACHE_SIZE = 16384
+WEEKDAYS = ['月曜日', '火曜日', '水曜日', '木曜日', '金曜日', '土曜日', '日曜日']
+_SPACE_RE = re.compile(r'\s+')
+_SYMBOL_RE = re.compile(r'[!！?？・･:：\-ー~〜_/／\(\)\[\]【】「」『』<>＜＞☆★♪＊*\.、。,]')
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def time_to_epoch(value: str) -> int:
+    """YYYYmmddHHMMSS を、タイムゾーンを考慮しない 1970-01-01 からの通算秒にする"""
+    return calendar.timegm((int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                            int(value[8:10]), int(value[10:12]), int(value[12:14])))
+
+
+def epoch_to_datetime(value: int) -> datetime:
+    return _EPOCH + timedelta(seconds=value)
+
+
+def epoch_to_time(value: int) -> str:
+    return epoch_to_datetime(value).strftime('%Y%m%d%H%M%S')
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
 def normalize_text(text: str) -> str:
     if not text:
         return ''
     text = unicodedata.normalize('NFKC', text)
     text = jaconv.z2h(text, kana=False, ascii=True, digit=True)
     text = text.lower()
-    text = re.sub(r'\s+', '', text)
-    text = re.sub(r'[!！?？・･:：\-ー~〜_/／\(\)\[\]【】「」『』<>＜＞☆★♪＊*\.、。,]', '', text)
+    text = _SPACE_RE.sub('', text)
+    text = _SYMBOL_RE.sub('', text)
     return text
 
 
@@ -33,7 +77,7 @@ class Words:
     stations: list
 
 
-@dataclass
+@dataclass(slots=True)
 class Program:
     station: str
     radiko_title: str
@@ -52,53 +96,162 @@ class Program:
     found_by: str = ''
     duration: int = 0
     filepath: str = ''
+    filehash: str = ''
+    # start_time/end_time を解析済みの通算秒。番組表の解析時に求め、未指定なら __post_init__ で求める
+    start_at: int = 0
+    end_at: int = 0
+
+    def __post_init__(self):
+        if not self.start_at and self.start_time:
+            self.start_at = time_to_epoch(self.start_time)
+        if not self.end_at and self.end_time:
+            self.end_at = time_to_epoch(self.end_time)
+
+    @property
+    def start_datetime(self) -> datetime:
+        return epoch_to_datetime(self.start_at)
+
+    @property
+    def end_datetime(self) -> datetime:
+        return epoch_to_datetime(self.end_at)
 
 
 class Radiko:
     MULTI_PART_MAX_GAP_SECONDS = 10 * 60
+    TIMEFREE_RETENTION_DAYS = 7
+    DEFAULT_FETCH_WORKERS = 4
+    DEFAULT_HTTP_TIMEOUT = 10.0
+    DEFAULT_PART_WORKERS = 3
+    DEFAULT_SEGMENT_WORKERS = 2
+    SEGMENT_RETRIES = 3
+    SEGMENT_RETRY_SECONDS = 30.0
+    # 検索ワードの stations にこの値を書くと、全エリアの全局を検索する
+    ALL_STATIONS = 'all'
+    # direct で保存先のフォルダに置く書きかけのファイル。これより古いものは異常終了の残りとみなす
+    PARTIAL_SUFFIX = '.partial.m4a'
+    STALE_PARTIAL_SECONDS = 60 * 60
     DEFAULT_KEY_STRIP_REGEX = [
         r'第?\d+回$',
         r'\d+時台$',
         r'エンディング$',
     ]
 
-    def __init__(self, rec_radiko_ts_sh: Path, radiko_email: str, radiko_pw: str, tmp_dir: Path, storage_dir: Path):
+    def __init__(self, rec_radiko_ts_sh: Path, radiko_email: str, radiko_pw: str, tmp_dir: Path, storage_dir: Path,
+                 fetch_workers: int = DEFAULT_FETCH_WORKERS, http_timeout: float = DEFAULT_HTTP_TIMEOUT,
+                 schedule_cache: ScheduleCache | None = None, rate_limiter: RateLimiter | None = None,
+                 part_workers: int = DEFAULT_PART_WORKERS, file_mover: FileMover | None = None,
+                 artwork_cache: ArtworkCache | None = None, plan_cache: PlanCache | None = None,
+                 segment_minutes: int = 0, segment_workers: int = DEFAULT_SEGMENT_WORKERS,
+                 record_backend: str = 'shell', download_workers: int = HlsDownloader.DEFAULT_WORKERS,
+                 auth_cache: Path | None = None, direct_storage: bool = False,
+                 plan_snapshot: PlanSnapshot | None = None):
         self.rec_radiko_ts_sh = rec_radiko_ts_sh
         self.radiko_email = radiko_email
         self.radiko_pw = radiko_pw
         self.tmp_dir = tmp_dir
         self.storage_dir = storage_dir
+        # 番組表で同じタイトルが何度も現れるため、キー生成結果をメモ化する
+        self._title_key_cached = lru_cache(maxsize=KEY_CACHE_SIZE)(self._compute_title_key)
+        self._series_key_cached = lru_cache(maxsize=KEY_CACHE_SIZE)(self._compute_series_key)
         self.key_strip_regex = list(self.DEFAULT_KEY_STRIP_REGEX)
+        self.fetch_workers = max(1, fetch_workers)
+        self.http_timeout = http_timeout
+        self.schedule_cache = schedule_cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.part_workers = max(1, part_workers)
+        self.file_mover = file_mover or FileMover()
+        self.artwork_cache = artwork_cache
+        self.plan_cache = plan_cache
+        self.plan_snapshot = plan_snapshot
+        self.segment_minutes = segment_minutes
+        self.segment_workers = max(1, segment_workers)
+        self.direct_storage = direct_storage
+        self._aborted = threading.Event()
+        # 実行中のプロセスと、それを止めるイベント（分割番組の枠ごと。単独の録音は None）
+        self._procs: dict[subprocess.Popen, threading.Event | None] = {}
+        self._procs_lock = threading.Lock()
+        self._part_cancels: dict[int, threading.Event] = {}
+        self._matchers: dict[int, tuple[object, TextMatcher]] = {}
+        self._rule_indexes: dict[int, tuple[list, tuple]] = {}
+        self.download_workers = max(1, download_workers)
+        self.session = self._http_session()
+        # 'shell' は rec_radiko_ts.sh、'native' は HlsDownloader で録音する
+        if record_backend == 'native':
+            self.downloader: HlsDownloader | None = HlsDownloader(self.session, workers=self.download_workers,
+                                                                  timeout=self.http_timeout)
+            # ログインと認証は録音ごとではなく、実行中に1度だけ行ってトークンを共有する
+            self.auth: RadikoAuth | None = RadikoAuth(self.downloader, radiko_email, radiko_pw, auth_cache)
+        elif record_backend == 'shell':
+            self.downloader = None
+            self.auth = None
+        else:
+            raise ValueError(f'unknown record_backend: {record_backend}')
+
+    def _http_session(self) -> requests.Session:
+        # 全局の取得で keep-alive の接続プールを共有する
+        session = requests.Session()
+        pool_size = max(self.fetch_workers, self.download_workers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     def _station_list(self, radio: list) -> list:
         stations = set()
         for pg in radio:
             if 'station' in pg:
                 stations.add(pg['station'])
-            if 'stations' in pg:
+            if 'stations' in pg and pg['stations'] != self.ALL_STATIONS:
                 stations.update(pg['stations'])
-        return list(stations)
+        return sorted(stations)
+
+    def _scan_all_stations(self, radio: list) -> bool:
+        return any(cf.get('stations') == self.ALL_STATIONS for cf in radio if 'words_by_mode' in cf)
 
     def _normalize_text(self, text: str) -> str:
         return normalize_text(text)
 
-    def _title_key(self, title: str) -> str:
-        key = jaconv.z2h(title, kana=False, ascii=True, digit=True)
-        for pattern in self.key_strip_regex:
+    @property
+    def key_strip_regex(self) -> list[str]:
+        return self._key_strip_regex
+
+    @key_strip_regex.setter
+    def key_strip_regex(self, patterns: list[str]) -> None:
+        # 設定読み込み時に一度だけコンパイル・検証し、不正なパターンはここで1回だけ警告する
+        compiled = []
+        for pattern in patterns:
             try:
-                key = re.sub(pattern, '', key)
+                compiled.append(re.compile(pattern))
             except re.error:
                 logger.warning(f'invalid regex in key_strip_regex: {pattern}')
+        self._key_strip_regex = list(patterns)
+        self._key_strip_patterns = compiled
+        self._title_key_cached.cache_clear()
+        self._series_key_cached.cache_clear()
+
+    def _strip_key(self, key: str) -> str:
+        for pattern in self._key_strip_patterns:
+            key = pattern.sub('', key)
         return key
 
+    def _compute_title_key(self, title: str) -> str:
+        return self._strip_key(jaconv.z2h(title, kana=False, ascii=True, digit=True))
+
+    def _compute_series_key(self, title: str) -> str:
+        return self._strip_key(self._normalize_text(title))
+
+    def _title_key(self, title: str) -> str:
+        return self._title_key_cached(title)
+
     def _series_key(self, title: str) -> str:
-        key = self._normalize_text(title)
-        for pattern in self.key_strip_regex:
-            try:
-                key = re.sub(pattern, '', key)
-            except re.error:
-                logger.warning(f'invalid regex in key_strip_regex: {pattern}')
-        return key
+        return self._series_key_cached(title)
+
+    def key_cache_info(self) -> dict:
+        return {
+            'normalize_text': normalize_text.cache_info(),
+            'title_key': self._title_key_cached.cache_info(),
+            'series_key': self._series_key_cached.cache_info(),
+        }
 
     def _key_strip_regex_config(self, radio: list) -> list[str]:
         for pg in radio:
@@ -106,28 +259,21 @@ class Radiko:
                 return pg['key_strip_regex']
         return list(self.DEFAULT_KEY_STRIP_REGEX)
 
-    def _title_matched(self, title: str, words: list[str], mode: str) -> bool:
-        if mode == 'regex':
-            for word in words:
-                try:
-                    if re.search(word, title, re.IGNORECASE):
-                        return True
-                except re.error:
-                    logger.warning(f'invalid regex in words: {word}')
-            return False
+    def _cached_matcher(self, owner: object, build) -> TextMatcher:
+        # radio.yaml のルール(dict/list)ごとに一度だけ構築する。id の再利用に備えて同一性も確認する
+        entry = self._matchers.get(id(owner))
+        if entry is None or entry[0] is not owner:
+            entry = (owner, TextMatcher(build(), self._normalize_text))
+            self._matchers[id(owner)] = entry
+        return entry[1]
 
-        normalized_title = self._normalize_text(title)
-        for word in words:
-            normalized_word = self._normalize_text(word)
-            if not normalized_word:
-                continue
-            if mode == 'exact' and normalized_title == normalized_word:
-                return True
-            if mode == 'contains' and normalized_word in normalized_title:
-                return True
-            if mode == 'prefix' and normalized_title.startswith(normalized_word):
-                return True
-        return False
+    def _word_matcher(self, cf: dict) -> TextMatcher:
+        return self._cached_matcher(cf, lambda: self._word_match_rules(cf))
+
+    def _title_matcher(self, cf: dict) -> TextMatcher:
+        match_mode = cf.get('title_match_mode', 'prefix')
+        match_titles = [cf['radiko_title']] + cf.get('radiko_aliases', [])
+        return self._cached_matcher(cf, lambda: [(title, match_mode) for title in match_titles])
 
     def _replace_config(self, radio: list) -> dict:
         replace_config = {}
@@ -147,10 +293,29 @@ class Radiko:
 
         return rules
 
-    def _get_programs_xml(self, station: str) -> str:
-        url = f'http://radiko.jp/v3/program/station/weekly/{station}.xml'
-        response = requests.get(url)
-        return response.text
+    def _get_xml(self, url: str, key: str) -> str | Path:
+        # キャッシュがあれば XML 全体を読み込まず、ファイルのパスを返して解析側で少しずつ読む
+        with phase('fetch', station=key) as m:
+            if self.schedule_cache:
+                xml = self.schedule_cache.get_path(self.session, url, key, self.http_timeout)
+                m['bytes'] = xml.stat().st_size
+            else:
+                response = self.session.get(url, timeout=self.http_timeout)
+                response.raise_for_status()
+                xml = response.text
+                m['bytes'] = len(xml.encode())
+        return xml
+
+    def _get_programs_xml(self, station: str) -> str | Path:
+        return self._get_xml(f'http://radiko.jp/v3/program/station/weekly/{station}.xml', station)
+
+    def _get_station_ids(self) -> list[str]:
+        """全エリアの局ID"""
+        xml = self._get_xml('https://radiko.jp/v3/station/region/full.xml', 'region_full')
+        root = ET.parse(xml).getroot() if isinstance(xml, Path) else ET.fromstring(xml)
+        ids = {self._child_text(station, 'id') for station in root.iter('station')}
+        ids.discard('')
+        return sorted(ids)
 
     def _child_text(self, elem: ET.Element, tag: str) -> str:
         child = elem.find(tag)
@@ -158,130 +323,211 @@ class Radiko:
             return ''
         return child.text
 
-    def _parse_programs_xml(self, xml: str, replace_config: dict) -> list[Program]:
-        progs: list[Program] = []
-        root = ET.fromstring(xml)
-        station_elem = root.find('.//station')
-        if station_elem is None:
-            return progs
-        station = station_elem.attrib.get('id', '')
-
-        for prog in root.findall('.//prog'):
-            ft = prog.attrib.get('ft')
-            to = prog.attrib.get('to')
-            if not ft or not to:
+    def _iter_prog_entries(self, xml: str | Path, window: tuple[str, str] | None = None) -> Iterator[tuple[str, str, str, str, str, str]]:
+        """番組表XMLを逐次解析し、(station, ft, to, title, img, pfm) を返す
+
+        xml がパスならファイルから少しずつ読む。window を指定した場合、開始時刻が [from, to) に入らない番組は生成前に捨てる。
+        """
+        station = None
+        # 解析済みの prog/progs を親から外し、木に1週間分の要素が溜まらないようにする
+        parents: list[ET.Element] = []
+        source = xml if isinstance(xml, Path) else io.StringIO(xml)
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == 'station' and station is None:
+                    station = elem.attrib.get('id', '')
+                parents.append(elem)
                 continue
-            title = self._child_text(prog, 'title')
-            img = self._child_text(prog, 'img')
-            pfm = self._child_text(prog, 'pfm')
-
-            if not title:
+            parents.pop()
+            if elem.tag == 'progs':
+                elem.clear()
+                if parents:
+                    parents[-1].remove(elem)
                 continue
-
-            for key, value in replace_config.items():
-                title = title.replace(key, value)
-
-            title_key = self._title_key(title)
-
-            ft_dt = datetime.strptime(ft, '%Y%m%d%H%M%S')
-            to_dt = datetime.strptime(to, '%Y%m%d%H%M%S')
-            duration = (to_dt - ft_dt).seconds
-
-            progs.append(
-                Program(
-                    station=station,
-                    radiko_title=title,
-                    start_time=ft,
-                    end_time=to,
-                    img=img,
-                    pfm=pfm.replace('\u3000', ' '),
-                    title_key=title_key,
-                    series_key=self._series_key(title),
-                    duration=duration
-                )
-            )
-
-        return progs
-
-    def _replace_tag(self, pg: Program, start_time: datetime, init_val: str) -> str:
+            if elem.tag != 'prog':
+                continue
+            if parents:
+                parents[-1].remove(elem)
+            if station is None:
+                elem.clear()
+                continue
+            ft = elem.attrib.get('ft')
+            to = elem.attrib.get('to')
+            if ft and to and (window is None or window[0] <= ft < window[1]):
+                title = self._child_text(elem, 'title')
+                if title:
+                    yield station, ft, to, title, self._child_text(elem, 'img'), self._child_text(elem, 'pfm')
+            elem.clear()
+
+    def _apply_replace(self, title: str, replace_config: dict) -> str:
+        for key, value in replace_config.items():
+            title = title.replace(key, value)
+        return title
+
+    def _clean_pfm(self, pfm: str) -> str:
+        # 出演者の区切りの全角スペースは半角にする（検索ワードの照合もこの値で行う）
+        return pfm.replace('\u3000', ' ')
+
+    def _make_program(self, entry: tuple[str, str, str, str, str, str], replace_config: dict) -> Program:
+        station, ft, to, title, img, pfm = entry
+        title = self._apply_replace(title, replace_config)
+
+        start_at = time_to_epoch(ft)
+        end_at = time_to_epoch(to)
+        # 局IDやキーは番組表に何度も現れるため、同じ文字列オブジェクトを共有する
+        return Program(
+            station=sys.intern(station),
+            radiko_title=title,
+            start_time=ft,
+            end_time=to,
+            img=img,
+            pfm=self._clean_pfm(pfm),
+            title_key=sys.intern(self._title_key(title)),
+            series_key=sys.intern(self._series_key(title)),
+            duration=end_at - start_at,
+            start_at=start_at,
+            end_at=end_at,
+        )
+
+    def _parse_programs_xml(self, xml: str | Path, replace_config: dict, window: tuple[str, str] | None = None) -> list[Program]:
+        return [self._make_program(entry, replace_config) for entry in self._iter_prog_entries(xml, window)]
+
+    def _expand_tag(self, start_time: datetime, init_val: str, pfm: str, album: str, title: str, artist: str) -> str:
 
         val = datetime.strftime(start_time, init_val)
 
-        val = val.replace('{pfm}', pg.pfm if pg.pfm else '')
-        if pg.album:
-            val = val.replace('{album}', pg.album)
-        if pg.title:
-            val = val.replace('{title}', pg.title)
-        if pg.artist:
-            val = val.replace('{artist}', pg.artist)
+        val = val.replace('{pfm}', pfm if pfm else '')
+        if album:
+            val = val.replace('{album}', album)
+        if title:
+            val = val.replace('{title}', title)
+        if artist:
+            val = val.replace('{artist}', artist)
         return val
 
-    def _recording_by_words(self, pg: Program, cf: dict) -> Program | None:
-        start_time = datetime.strptime(pg.start_time, '%Y%m%d%H%M%S')
-        rules = self._word_match_rules(cf)
-        for word, mode in rules:
-            if self._title_matched(pg.radiko_title, [word], mode) or self._title_matched(pg.pfm, [word], mode):
-                base = replace(pg,
-                    artist=pg.pfm,
-                    album=pg.title_key,
-                    title=pg.title_key,
-                    storage_dir=pg.title_key,
-                    found_by='words',
-                )
-                return replace(base,
-                    filename=self._replace_tag(base, start_time, base.title_key + '_%Y%m%d') + '.m4a',
-                )
-        return None
-
-    def _recording_by_title(self, pg: Program, cf: dict) -> Program | None:
-        start_time = datetime.strptime(pg.start_time, '%Y%m%d%H%M%S')
-        weekdays = ['月曜日', '火曜日', '水曜日', '木曜日', '金曜日', '土曜日', '日曜日']
-
-        if 'radiko_dayw' in cf:
-            weekday_num = start_time.weekday()
-            weekday = weekdays[weekday_num]
-            same_weekday = (weekday == cf['radiko_dayw'])
-        else:
-            same_weekday = True
-
-        station = cf['station']
-        match_mode = cf.get('title_match_mode', 'prefix')
-        match_titles = [cf['radiko_title']] + cf.get('radiko_aliases', [])
-        if pg.station == station and self._title_matched(pg.radiko_title, match_titles, match_mode) and same_weekday:
-            # artist/album を先に確定させる（storage_dir 等で {artist}/{album} を参照するため）
-            base = replace(pg,
-                artist=self._replace_tag(pg, start_time, cf['artist']),
-                album=self._replace_tag(pg, start_time, cf['album']),
-            )
-            matched = replace(base,
-                title=self._replace_tag(base, start_time, cf['title']),
-                filename=self._replace_tag(base, start_time, cf['filename']) + '.m4a',
-                storage_dir=self._replace_tag(base, start_time, cf['storage_dir']),
-                series_key=self._series_key(cf.get('series_key', cf['radiko_title'])),
-                found_by='title',
-            )
-            return matched
+    def _replace_tag(self, pg: Program, start_time: datetime, init_val: str) -> str:
+        return self._expand_tag(start_time, init_val, pg.pfm, pg.album, pg.title, pg.artist)
+
+    def _words_program(self, pg: Program, start_time: datetime) -> Program:
+        key = pg.title_key
+        return replace(pg,
+            artist=pg.pfm,
+            album=key,
+            title=key,
+            storage_dir=key,
+            found_by='words',
+            filename=self._expand_tag(start_time, key + '_%Y%m%d', pg.pfm, key, key, pg.pfm) + '.m4a',
+        )
+
+    def _title_program(self, pg: Program, cf: dict, start_time: datetime) -> Program:
+        # artist/album を先に確定させる（storage_dir 等で {artist}/{album} を参照するため）
+        artist = self._replace_tag(pg, start_time, cf['artist'])
+        album = self._replace_tag(pg, start_time, cf['album'])
+
+        def expand(init_val: str) -> str:
+            return self._expand_tag(start_time, init_val, pg.pfm, album, pg.title, artist)
+
+        return replace(pg,
+            artist=artist,
+            album=album,
+            title=expand(cf['title']),
+            filename=expand(cf['filename']) + '.m4a',
+            storage_dir=expand(cf['storage_dir']),
+            series_key=self._series_key(cf.get('series_key', cf['radiko_title'])),
+            found_by='title',
+        )
+
+    def _rule_index(self, radio: list) -> tuple[list[dict], dict[str, list[list[dict]]]]:
+        # 検索ワードのルールと、局→曜日ごとの番組指定ルールに振り分ける。各リストは radio.yaml の順序を保つ
+        entry = self._rule_indexes.get(id(radio))
+        if entry is not None and entry[0] is radio:
+            return entry[1]
+        word_cfs = []
+        title_cfs: dict[str, list[list[dict]]] = {}
+        for cf in radio:
+            if 'words_by_mode' in cf:
+                word_cfs.append(cf)
+            elif 'station' in cf:
+                by_weekday = title_cfs.setdefault(cf['station'], [[] for _ in WEEKDAYS])
+                for weekday_num, weekday in enumerate(WEEKDAYS):
+                    if cf.get('radiko_dayw', weekday) == weekday:
+                        by_weekday[weekday_num].append(cf)
+        index = (word_cfs, title_cfs)
+        self._rule_indexes[id(radio)] = (radio, index)
+        return index
+
+    def _match_rules(self, pg: Program, word_cfs: list[dict], title_cfs: dict[str, list[list[dict]]]) -> Program | None:
+        # 番組指定ルールに一致すればそれを優先し（radio.yaml で先のルール）、なければ検索ワードで判定する
+        start_time = None
+        by_weekday = title_cfs.get(pg.station)
+        if by_weekday:
+            start_time = pg.start_datetime
+            for cf in by_weekday[start_time.weekday()]:
+                if self._title_matcher(cf).first_match(pg.radiko_title) is not None:
+                    return self._title_program(pg, cf, start_time)
+        for cf in word_cfs:
+            if self._word_matcher(cf).first_match(pg.radiko_title, pg.pfm) is not None:
+                return self._words_program(pg, start_time or pg.start_datetime)
         return None
 
     def _filter_programs(self, programs: list, radio: list) -> dict:
+        word_cfs, title_cfs = self._rule_index(radio)
+        return self._group_matches([self._match_rules(pg, word_cfs, title_cfs) for pg in programs])
+
+    def _replan_programs(self, station: str, xml: str | Path, radio: list, replace_config: dict,
+                         window: tuple[str, str] | None, config_hash: str, full_replan: bool) -> dict:
+        # 前回から変わっていない番組は前回の抽出結果を使い、追加・変更された番組だけ判定し直す
+        # 対象期間外の結果は --list-upcoming と録音で期間が違っても消えないよう、判定に使わなくても読み込んで残す
+        stored = self.plan_cache.load(station, config_hash)
+        previous = {} if full_replan else stored
+        word_cfs, title_cfs = self._rule_index(radio)
+        current: dict[str, tuple[str, str, Program | None]] = {}
+        reused = 0
+        for entry in self._iter_prog_entries(xml, window):
+            fp = PlanCache.fingerprint(entry)
+            if fp in previous:
+                cached = previous[fp][2]
+                pg = Program(**cached) if cached is not None else None
+                reused += 1
+            else:
+                pg = self._match_rules(self._make_program(entry, replace_config), word_cfs, title_cfs)
+            current[fp] = (entry[1], entry[2], pg)
+        self.plan_cache.store(station, config_hash, current, stored, window)
+        logger.debug(f'replanned {station}: {len(current) - reused} of {len(current)} entries')
+        return self._group_matches(pg for _, _, pg in current.values())
+
+    def _scan_programs(self, xml: str | Path, radio: list, replace_config: dict,
+                       window: tuple[str, str] | None) -> dict:
+        # 検索ワードだけで探す局。番組表は列形式で持ち、一致した行だけ Program にする
+        table = ScheduleTable()
+        replaced: dict[str, str] = {}
+        for station, ft, to, title, img, pfm in self._iter_prog_entries(xml, window):
+            if title not in replaced:
+                replaced[title] = self._apply_replace(title, replace_config)
+            # Program と同じ値で照合するよう、タイトルは置換後、出演者は区切りを直した値を持つ
+            table.append(station, time_to_epoch(ft), time_to_epoch(to), replaced[title], img, self._clean_pfm(pfm))
+        word_cfs, _ = self._rule_index(radio)
+        rows = table.match(self._word_matcher(cf) for cf in word_cfs)
+        logger.debug(f'scanned {len(table)} entries ({table.nbytes()} bytes), {len(rows)} matched')
+        matches = []
+        for station, start_at, end_at, title, img, pfm in table.rows(rows):
+            entry = (station, epoch_to_time(start_at), epoch_to_time(end_at), title, img, pfm)
+            pg = self._make_program(entry, {})
+            matches.append(self._words_program(pg, pg.start_datetime))
+        return self._group_matches(matches)
+
+    def _group_matches(self, matches) -> dict:
+        # 抽出結果を同日同番組にまとめる。部分的に再判定した場合もここは毎回全体をやり直す
         found_programs = {}
-        for pg in programs:
-            for cf in radio:
-                if 'words_by_mode' in cf:
-                    rec_pg = self._recording_by_words(pg, cf)
-                elif 'station' in cf:
-                    rec_pg = self._recording_by_title(pg, cf)
-                else:
-                    continue
-
-                if rec_pg:
-                    # 重複排除
-                    key = '_'.join([rec_pg.station, rec_pg.radiko_title, rec_pg.start_time])
-                    if key in found_programs:
-                        if found_programs[key].found_by == 'words':
-                            found_programs[key] = rec_pg
-                    else:
+        for rec_pg in matches:
+            if rec_pg:
+                # 重複排除
+                key = '_'.join([rec_pg.station, rec_pg.radiko_title, rec_pg.start_time])
+                if key in found_programs:
+                    if found_programs[key].found_by == 'words':
                         found_programs[key] = rec_pg
+                else:
+                    found_programs[key] = rec_pg
 
         grouped = {}
         for title_key in sorted(found_programs.keys()):
@@ -311,10 +557,10 @@ class Radiko:
         return program
 
     def _match_word_key(self, program: Program, word_rules: list[tuple[str, str]]) -> str:
-        for word, mode in word_rules:
-            if self._title_matched(program.radiko_title, [word], mode) or self._title_matched(program.pfm, [word], mode):
-                return self._normalize_text(word)
-        return ''
+        index = self._cached_matcher(word_rules, lambda: word_rules).first_match(program.radiko_title, program.pfm)
+        if index is None:
+            return ''
+        return self._normalize_text(word_rules[index][0])
 
     def _dedupe_key(self, program: Program | list[Program], word_rules: list[tuple[str, str]]) -> str:
         # 同日かつ同一ワード(優先)または同一正規化タイトルを重複候補とする（異なる局・時間帯も含む）
@@ -328,20 +574,73 @@ class Radiko:
         if not programs:
             return []
 
-        sorted_programs = sorted(programs, key=lambda pg: pg.start_time)
+        sorted_programs = sorted(programs, key=lambda pg: pg.start_at)
         chunks = [[sorted_programs[0]]]
         for pg in sorted_programs[1:]:
-            prev = chunks[-1][-1]
-            prev_end = datetime.strptime(prev.end_time, '%Y%m%d%H%M%S')
-            current_start = datetime.strptime(pg.start_time, '%Y%m%d%H%M%S')
-            gap = (current_start - prev_end).total_seconds()
+            gap = pg.start_at - chunks[-1][-1].end_at
             if 0 <= gap <= self.MULTI_PART_MAX_GAP_SECONDS:
                 chunks[-1].append(pg)
             else:
                 chunks.append([pg])
         return chunks
 
-    def get_programs(self, radio: list) -> dict:
+    def _merge_programs(self, programs: dict, progs: dict, word_rules: list[tuple[str, str]]) -> None:
+        # 同日同番組が複数局にある場合、放送時間が長い方を採用（同じなら指定番組マッチを優先）
+        for _, program in progs.items():
+            dedupe_key = self._dedupe_key(program, word_rules)
+            if dedupe_key in programs:
+                program1 = programs[dedupe_key]
+                duration1 = self._duration(program1)
+                duration2 = self._duration(program)
+                if duration2 > duration1:
+                    programs[dedupe_key] = program
+                elif duration2 == duration1:
+                    existing_found_by = self._program_start(program1).found_by
+                    new_found_by = self._program_start(program).found_by
+                    if existing_found_by == 'words' and new_found_by == 'title':
+                        programs[dedupe_key] = program
+            else:
+                programs[dedupe_key] = program
+
+    def _fetch_and_filter(self, stations: list, radio: list, replace_config: dict,
+                          window: tuple[str, str] | None = None, full_replan: bool = False,
+                          scan_stations: list | None = None) -> dict:
+        # 番組表を並列取得し、届いた順に解析・抽出する
+        results = {}
+        config_hash = PlanCache.config_hash(radio) if self.plan_cache else ''
+        scan_stations = scan_stations or []
+        targets = stations + scan_stations
+        with ThreadPoolExecutor(max_workers=min(self.fetch_workers, max(1, len(targets)))) as executor:
+            futures = {executor.submit(self._get_programs_xml, station): station for station in targets}
+            for future in as_completed(futures):
+                station = futures[future]
+                if station in scan_stations:
+                    # 全局検索で追加した局は、取得できなくても他の局の計画は続ける
+                    try:
+                        xml = future.result()
+                    except Exception as e:
+                        logger.warning(f'failed to fetch schedule of {station}: {e}')
+                        results[station] = {}
+                        continue
+                    with phase('scan', station=station):
+                        results[station] = self._scan_programs(xml, radio, replace_config, window)
+                    continue
+                xml = future.result()
+                if self.plan_cache:
+                    with phase('replan', station=station):
+                        results[station] = self._replan_programs(station, xml, radio, replace_config, window,
+                                                                 config_hash, full_replan)
+                else:
+                    with phase('parse', station=station):
+                        progs = self._parse_programs_xml(xml, replace_config, window)
+                    with phase('filter', station=station):
+                        results[station] = self._filter_programs(progs, radio)
+                logger.debug(f'fetched {station}: {len(results[station])} programs')
+        return results
+
+    def get_programs(self, radio: list, window: tuple[str, str] | None = None, full_replan: bool = False) -> dict:
+        self._matchers = {}
+        self._rule_indexes = {}
         self.key_strip_regex = self._key_strip_regex_config(radio)
         replace_config = self._replace_config(radio)
         stations = self._station_list(radio)
@@ -349,67 +648,187 @@ class Radiko:
         for cf in radio:
             if 'words_by_mode' in cf:
                 word_rules.extend(self._word_match_rules(cf))
+        scan_stations = []
+        if self._scan_all_stations(radio):
+            scan_stations = [station for station in self._get_station_ids() if station not in stations]
+            logger.info(f'scanning {len(scan_stations)} more stations for words')
+        results = self._fetch_and_filter(stations, radio, replace_config, window, full_replan, scan_stations)
         programs = {}
-        for station in stations:
-            xml = self._get_programs_xml(station)
-            progs = self._parse_programs_xml(xml, replace_config)
-            progs = self._filter_programs(progs, radio)
-            # 同日同番組が複数局にある場合、放送時間が長い方を採用（同じなら指定番組マッチを優先）
-            for _, program in progs.items():
-                dedupe_key = self._dedupe_key(program, word_rules)
-                if dedupe_key in programs:
-                    program1 = programs[dedupe_key]
-                    duration1 = self._duration(program1)
-                    duration2 = self._duration(program)
-                    if duration2 > duration1:
-                        programs[dedupe_key] = program
-                    elif duration2 == duration1:
-                        existing_found_by = self._program_start(program1).found_by
-                        new_found_by = self._program_start(program).found_by
-                        if existing_found_by == 'words' and new_found_by == 'title':
-                            programs[dedupe_key] = program
-                else:
-                    programs[dedupe_key] = program
+        # 取得完了順に依存しないよう、局の並び順でマージする（radio.yaml に書いた局を先にする）
+        with phase('dedupe'):
+            for station in stations + scan_stations:
+                self._merge_programs(programs, results[station], word_rules)
         logger.info(f'found {len(programs)} programs')
+        for name, info in self.key_cache_info().items():
+            logger.debug(f'{name} cache: hits={info.hits} misses={info.misses} size={info.currsize}')
         for program in programs.values():
             if isinstance(program, list):
                 program = program[0]
             logger.info(f'{program.found_by} {program.station} {program.radiko_title} {program.start_time} {program.end_time}')
+        if self.plan_snapshot and self.schedule_cache:
+            self.plan_snapshot.store(PlanCache.config_hash(radio), window, self.schedule_cache.digest(), programs)
         return programs
 
-    def _get_artwork(self, program: Program) -> bytes:
-        response = requests.get(program.img)
+    def cached_programs(self, radio: list, window: tuple[str, str] | None = None) -> dict | None:
+        """radio.yaml・番組表・対象期間が前回の get_programs から変わっていなければ、その結果を返す"""
+        if not (self.plan_snapshot and self.schedule_cache):
+            return None
+        with phase('snapshot'):
+            entries = self.plan_snapshot.load(PlanCache.config_hash(radio), window, self.schedule_cache.digest())
+        if entries is None:
+            return None
+        return {key: [Program(**pg) for pg in entry] if isinstance(entry, list) else Program(**entry)
+                for key, entry in entries.items()}
+
+    def _download_artwork(self, url: str) -> bytes:
+        response = self.session.get(url, timeout=self.http_timeout)
         if response.status_code == 200:
             return response.content
         else:
             raise Exception(f'Failed to download JPEG file. Status code: {response.status_code}')
 
-    def _rec_radiko_ts_sh(self, program: Program) -> Path | None:
-        url = f'https://radiko.jp/#!/ts/{program.station}/{program.start_time}'
-        filepath = self.tmp_dir / program.filename
+    def _get_artwork(self, program: Program) -> bytes:
+        # アートワークが取れなくても録音は続ける（カバーなしでタグ付けする）
+        if not program.img:
+            return b''
+        try:
+            with phase('artwork', station=program.station, program=program.radiko_title) as m:
+                if self.artwork_cache:
+                    artwork = self.artwork_cache.get(self.session, program.img)
+                else:
+                    artwork = self._download_artwork(program.img)
+                m['bytes'] = len(artwork)
+            return artwork
+        except Exception as e:
+            logger.warning(f'failed to get artwork for {program.radiko_title}: {e}')
+            return b''
+
+    def prefetch_artwork(self, programs: list[Program | list[Program]]) -> None:
+        if self.artwork_cache:
+            self.artwork_cache.prefetch(self.session, [self._program_start(pg).img for pg in programs])
+
+    def _rec_radiko_ts_sh(self, program: Program, filepath: Path | None = None,
+                          start: str = '', end: str = '') -> Path | None:
+        if filepath is None:
+            filepath = self.tmp_dir / program.filename
+        if start:
+            # 番組の一部 [start, end) だけを録音する。rec_radiko_ts.sh の -f/-t は分単位
+            target = ['-s', program.station, '-f', start[:12], '-t', end[:12]]
+        else:
+            target = ['-u', f'https://radiko.jp/#!/ts/{program.station}/{program.start_time}']
         param = [self.rec_radiko_ts_sh,
-                 '-u', url,
+                 *target,
                  '-o', filepath]
         if self.radiko_email and self.radiko_pw:
             param.extend(['-m', self.radiko_email, '-p', self.radiko_pw])
 
         logger.debug(param)
+        self.rate_limiter.wait()
+        with phase('rec_radiko_ts', station=program.station, program=program.radiko_title) as m:
+            returncode = self._run_process(param, cancel=self._part_cancels.get(id(program)))
+            if returncode == 0:
+                m['bytes'] = filepath.stat().st_size if filepath.exists() else 0
+            else:
+                m['status'] = 'error'
+        if returncode == 0:
+            self.rate_limiter.success()
+            return filepath
+        if not self._cancelled(program):
+            self.rate_limiter.failure()
+        # 書きかけのファイルは残さない
+        filepath.unlink(missing_ok=True)
+        return None
+
+    def _download(self, program: Program, filepath: Path | None = None,
+                  start: str = '', end: str = '') -> Path | None:
+        if self.downloader:
+            return self._download_native(program, filepath, start, end)
+        return self._rec_radiko_ts_sh(program, filepath, start, end)
+
+    def _download_native(self, program: Program, filepath: Path | None = None,
+                         start: str = '', end: str = '') -> Path | None:
+        assert self.downloader is not None and self.auth is not None
+        if filepath is None:
+            filepath = self.tmp_dir / program.filename
+        self.rate_limiter.wait()
+        with phase('hls_download', station=program.station, program=program.radiko_title) as m:
+            try:
+                ft, to = start or program.start_time, end or program.end_time
+                cancel = self._part_cancels.get(id(program))
+                try:
+                    self.downloader.download(program.station, ft, to, filepath, self.auth.token(), cancel)
+                except AuthError:
+                    # 期限前に失効したトークンは取り直して1度だけやり直す
+                    self.auth.invalidate()
+                    self.downloader.download(program.station, ft, to, filepath, self.auth.token(), cancel)
+                m['bytes'] = filepath.stat().st_size
+            except (DownloadError, requests.RequestException, OSError) as e:
+                m['status'] = 'error'
+                logger.error(f'failed to download {program.radiko_title}: {e}')
+                if not self._cancelled(program):
+                    self.rate_limiter.failure()
+                filepath.unlink(missing_ok=True)
+                return None
+        self.rate_limiter.success()
+        return filepath
+
+    def _run_process(self, param: list, timeout: float = 45 * 60, cancel: threading.Event | None = None) -> int | None:
+        # abort() や分割番組の他の枠の失敗で止められるよう、実行中のプロセスを登録しておく
+        with self._procs_lock:
+            if self._aborted.is_set() or (cancel and cancel.is_set()):
+                return None
+            # rec_radiko_ts.sh が起動する ffmpeg もまとめて止められるよう、別プロセスグループで起動する
+            proc = subprocess.Popen(param, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                    start_new_session=True)
+            self._procs[proc] = cancel
         try:
-            result = subprocess.run(
-                param,
-                capture_output=True,
-                text=True,
-                timeout=45 * 60,
-            )
+            proc.communicate(timeout=timeout)
         except subprocess.TimeoutExpired:
+            self._signal_process(proc, signal.SIGKILL)
+            proc.communicate()
             return None
-
-        if result.returncode == 0:
-            return filepath
-        else:
-            return None
+        finally:
+            with self._procs_lock:
+                self._procs.pop(proc, None)
+        return proc.returncode
+
+    def abort(self) -> None:
+        """実行中の録音を止め、以降の録音を開始しない"""
+        with self._procs_lock:
+            self._aborted.set()
+            self.rate_limiter.abort()
+            if self.downloader:
+                self.downloader.abort()
+            for cancel in self._part_cancels.values():
+                cancel.set()
+            for proc in self._procs:
+                self._signal_process(proc, signal.SIGTERM)
+
+    @property
+    def abort_event(self) -> threading.Event:
+        """abort() でセットされるイベント"""
+        return self._aborted
+
+    def _cancel_parts(self, cancel: threading.Event) -> None:
+        """分割番組の残りの枠の録音を止める（録音中の枠のプロセスも止める）"""
+        with self._procs_lock:
+            cancel.set()
+            for proc, proc_cancel in self._procs.items():
+                if proc_cancel is cancel:
+                    self._signal_process(proc, signal.SIGTERM)
+
+    def _cancelled(self, program: Program) -> bool:
+        cancel = self._part_cancels.get(id(program))
+        return self._aborted.is_set() or bool(cancel and cancel.is_set())
+
+    def _signal_process(self, proc: subprocess.Popen, sig: int) -> None:
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            pass
 
     def _set_attr(self, program: Program, filepath: Path, artwork: bytes) -> None:
+        from mutagen.mp4 import MP4, MP4Cover
 
         mp4 = MP4(filepath)
         tags = mp4.tags
@@ -418,38 +837,168 @@ class Radiko:
             tags = mp4.tags
             if tags is None:
                 raise RuntimeError(f'failed to create tags for {filepath}')
+        # 結合時に ffmpeg でタグ付け済みなら、ここでは一致を確認するだけで書き換えない
         prm = {
-            '\xa9alb': program.album,
-            '\xa9nam': program.title,
-            '\xa9ART': program.artist,
-            'covr': [MP4Cover(artwork)]}
+            '\xa9alb': [program.album],
+            '\xa9nam': [program.title],
+            '\xa9ART': [program.artist]}
+        if artwork:
+            imageformat = MP4Cover.FORMAT_PNG if artwork.startswith(b'\x89PNG') else MP4Cover.FORMAT_JPEG
+            prm['covr'] = [MP4Cover(artwork, imageformat)]
 
         changed = False
         for name, value in prm.items():
-            if tags.get(name, '') != value:
+            # 空の値は ffmpeg も書かないため、タグが無い状態を正とする
+            if value == ['']:
+                if name in tags:
+                    del tags[name]
+                    changed = True
+            elif tags.get(name, []) != value:
                 tags[name] = value
                 changed = True
 
         if changed:
+            logger.debug(f'updating tags of {filepath}')
             tags.save(filepath)
 
-    def _mv_file(self, program: Program, src: Path) -> Path:
+    def _verify(self, filepath: Path) -> None:
+        from mutagen.mp4 import MP4
+
+        if filepath.stat().st_size == 0 or not MP4(filepath).info.length:
+            raise RuntimeError(f'empty recording: {filepath}')
+
+    def _work_path(self, program: Program) -> Path:
+        # direct では保存先のフォルダに隠しファイルとして録音し、タグ付けと検証の後に rename で公開する
+        if not self.direct_storage:
+            return self.tmp_dir / program.filename
+        directory = self.storage_dir / program.storage_dir
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory / f'.{Path(program.filename).stem}{self.PARTIAL_SUFFIX}'
+
+    def _is_segment_dir(self, name: str) -> bool:
+        return name.startswith('.') and name.endswith('.segments')
+
+    def _remove_stale(self, path: Path, max_age: float, now: float) -> bool:
+        try:
+            if now - path.stat().st_mtime <= max_age:
+                return False
+            if path.is_dir():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+        except OSError as e:
+            logger.warning(f'failed to remove {path}: {e}')
+            return False
+        logger.warning(f'removed stale {path}')
+        return True
+
+    def cleanup_partials(self, programs: dict | None = None) -> int:
+        """異常終了時に残った書きかけのファイルを消す。区間録音のフォルダはタイムフリーで再開できる間は残す
+
+        tmp_dir は直下の区間録音のフォルダだけを見る。direct では get_programs の結果 programs の番組の
+        保存先のフォルダ（直下のみ）にある書きかけのファイルも消す。NAS 上の storage_dir 全体は走査しない。
+        """
+        now = time.time()
+        retention = self.TIMEFREE_RETENTION_DAYS * 24 * 60 * 60
+        removed = 0
+        if self.tmp_dir.is_dir():
+            for path in self.tmp_dir.iterdir():
+                if self._is_segment_dir(path.name) and path.is_dir():
+                    removed += self._remove_stale(path, retention, now)
+        if not self.direct_storage or not programs:
+            return removed
+        directories = set()
+        for program in programs.values():
+            for pg in program if isinstance(program, list) else [program]:
+                directories.add(self.storage_dir / pg.storage_dir)
+        for directory in sorted(directories):
+            try:
+                paths = list(directory.iterdir())
+            except OSError:
+                continue
+            for path in paths:
+                name = path.name
+                if self._is_segment_dir(name):
+                    if path.is_dir():
+                        removed += self._remove_stale(path, retention, now)
+                elif name.startswith('.') and ('.partial.' in name or name.endswith('.partial')):
+                    removed += self._remove_stale(path, self.STALE_PARTIAL_SECONDS, now)
+        return removed
+
+    def _mv_file(self, program: Program, src: Path) -> MoveResult:
         dst = self.storage_dir / program.storage_dir / program.filename
-        dst.parent.mkdir(parents=True, exist_ok=True)
-        subprocess.run(['cp', str(src), str(dst)], check=True)
-        src.unlink()
-        return dst
+        return self.file_mover.move(src, dst)
+
+    def _concatenate_m4a(self, files: list[Path], output_path: Path,
+                         program: Program | None = None, artwork: bytes = b'') -> None:
+        from .audio_concatenator import AudioConcatenator
 
-    def _concatenate_m4a(self, files: list[Path], output_path: Path) -> None:
         ac = AudioConcatenator(output_path)
         for file in files:
             ac.add_file(file)
+        if program:
+            ac.set_metadata(album=program.album, title=program.title, artist=program.artist)
+        ac.set_cover(artwork)
         ac.concatenate()
 
-    def _record_one(self, program: Program) -> Path | None:
+    def _segments(self, program: Program) -> list[tuple[str, str]]:
+        # 番組の開始・終了で切り、途中は segment_minutes ごとに区切る（隙間も重複もない）
+        step = self.segment_minutes * 60
+        return [(epoch_to_time(start), epoch_to_time(min(start + step, program.end_at)))
+                for start in range(program.start_at, program.end_at, step)]
+
+    def _record_segment(self, program: Program, start: str, end: str, filepath: Path) -> Path | None:
+        # 録音できた区間だけを正式な名前にするので、ファイルがあればその区間は録音済み
+        if filepath.exists():
+            return filepath
+        partial = filepath.with_name(f'{filepath.stem}.partial.m4a')
+        for attempt in range(self.SEGMENT_RETRIES + 1):
+            if attempt:
+                delay = self.SEGMENT_RETRY_SECONDS * 2 ** (attempt - 1)
+                logger.warning(f'retrying {program.radiko_title} {start}-{end} in {delay:.0f}s')
+                if self._part_cancels.get(id(program), self._aborted).wait(delay):
+                    return None
+            if self._download(program, partial, start, end):
+                partial.replace(filepath)
+                return filepath
+            if self._cancelled(program):
+                return None
+        return None
+
+    def _record_segmented(self, program: Program, filepath: Path) -> Path | None:
+        """番組を区間ごとに録音して結合する。失敗しても録音済みの区間は残し、次回は残りだけ録音する"""
+        segment_dir = filepath.with_name(f'.{filepath.stem.lstrip(".")}.segments')
+        segment_dir.mkdir(parents=True, exist_ok=True)
+        segments = self._segments(program)
+        paths = [segment_dir / f'{start}-{end}.m4a' for start, end in segments]
+        # 放送時間や区間の長さが変わった場合の古い区間は使わない
+        for stale in segment_dir.iterdir():
+            if stale not in paths:
+                stale.unlink()
+        missing = [(segment, path) for segment, path in zip(segments, paths) if not path.exists()]
+        if len(missing) < len(segments):
+            logger.info(f'resuming {program.radiko_title}: {len(segments) - len(missing)}/{len(segments)} segments recorded')
+
+        with ThreadPoolExecutor(max_workers=min(self.segment_workers, max(1, len(missing)))) as executor:
+            recorded = list(executor.map(lambda item: self._record_segment(program, *item[0], item[1]), missing))
+        if not all(recorded):
+            return None
+        try:
+            self._concatenate_m4a(paths, filepath)
+        except Exception as e:
+            logger.error(f'failed to concatenate segments of {program.radiko_title}: {e}')
+            filepath.unlink(missing_ok=True)
+            return None
+        shutil.rmtree(segment_dir)
+        return filepath
+
+    def _record_one(self, program: Program, filepath: Path | None = None) -> Path | None:
         logger.info(f'recording {program.radiko_title} ...')
 
-        filepath = self._rec_radiko_ts_sh(program)
+        if self.segment_minutes and program.duration > self.segment_minutes * 60:
+            filepath = self._record_segmented(program, filepath or self.tmp_dir / program.filename)
+        else:
+            filepath = self._download(program, filepath)
         if not filepath:
             logger.error(f'failed to record {program.radiko_title}')
             return None
@@ -457,6 +1006,35 @@ class Radiko:
         logger.info(f'recorded {program.radiko_title} at {filepath}')
         return filepath
 
+    def _record_parts(self, programs: list[Program], filepaths: list[Path]) -> None:
+        # 分割番組の各枠を別々の一時ファイルへ並列に録音する。1枠でも失敗したら録音中の枠も止めて残りを中止する
+        cancel = threading.Event()
+        with self._procs_lock:
+            if self._aborted.is_set():
+                cancel.set()
+            for pg in programs:
+                self._part_cancels[id(pg)] = cancel
+        executor = ThreadPoolExecutor(max_workers=min(self.part_workers, len(programs)))
+        try:
+            futures = {executor.submit(self._record_one, pg, filepath): pg
+                       for pg, filepath in zip(programs, filepaths)}
+            for future in as_completed(futures):
+                pg = futures[future]
+                try:
+                    filepath = future.result()
+                except Exception as e:
+                    filepath = None
+                    logger.exception(e)
+                if filepath is None:
+                    self._cancel_parts(cancel)
+                    raise RuntimeError(f'{pg.radiko_title}: 録音でエラー')
+        finally:
+            # 止めた枠のプロセスが終わるのを待ってから、呼び出し元で一時ファイルを消す
+            executor.shutdown(wait=True, cancel_futures=True)
+            with self._procs_lock:
+                for pg in programs:
+                    self._part_cancels.pop(id(pg), None)
+
     def record(self, program: Program | list[Program]) -> Program:
         target_program: Program
         recorded_filepath: Path
@@ -468,49 +1046,49 @@ class Radiko:
 
             target_program = program[0]
             artwork = self._get_artwork(target_program)
-            concat_filepath: Path | None = None
-            filepaths: list[Path] = []
+            concat_filepath = self._work_path(target_program)
+            filepaths = [concat_filepath.with_suffix('.' + str(index) + '.m4a') for index in range(len(program))]
 
-            for index, pg in enumerate(program):
-                part_filepath = self._record_one(pg)
-                if part_filepath is None:
-                    raise RuntimeError(f'{pg.radiko_title}: 録音でエラー')
-                if concat_filepath is None:
-                    concat_filepath = part_filepath
-                new_filepath = part_filepath.with_suffix('.' + str(index) + '.m4a')
-                if new_filepath.exists():
-                    new_filepath.unlink()
-                part_filepath.rename(new_filepath)
-                filepaths.append(new_filepath)
-
-            if concat_filepath is None:
-                raise RuntimeError('failed to initialize concat filepath')
-
-            logger.info(f'concatenating {len(filepaths)} files ...')
             try:
-                self._concatenate_m4a(filepaths, concat_filepath)
-            except Exception as e:
-                raise RuntimeError(f'{target_program.radiko_title}: 結合でエラー') from e
-            logger.info(f'concatenated {len(filepaths)} files to {concat_filepath}')
-            for part_filepath in filepaths:
-                part_filepath.unlink()
+                self._record_parts(program, filepaths)
+                logger.info(f'concatenating {len(filepaths)} files ...')
+                try:
+                    with phase('concat', station=target_program.station, program=target_program.radiko_title) as m:
+                        self._concatenate_m4a(filepaths, concat_filepath, target_program, artwork)
+                        m['bytes'] = concat_filepath.stat().st_size
+                except Exception as e:
+                    concat_filepath.unlink(missing_ok=True)
+                    raise RuntimeError(f'{target_program.radiko_title}: 結合でエラー') from e
+                logger.info(f'concatenated {len(filepaths)} files to {concat_filepath}')
+            finally:
+                for part_filepath in filepaths:
+                    part_filepath.unlink(missing_ok=True)
             recorded_filepath = concat_filepath
         else:
             target_program = program
             artwork = self._get_artwork(target_program)
-            one_filepath = self._record_one(target_program)
+            one_filepath = self._record_one(target_program, self._work_path(target_program))
             if one_filepath is None:
                 raise RuntimeError(f'{target_program.radiko_title}: 録音でエラー')
             recorded_filepath = one_filepath
 
+        labels = {'station': target_program.station, 'program': target_program.radiko_title}
         try:
-            self._set_attr(target_program, recorded_filepath, artwork)
+            with phase('tag', **labels):
+                self._set_attr(target_program, recorded_filepath, artwork)
+                if self.direct_storage:
+                    self._verify(recorded_filepath)
         except Exception as e:
+            if self.direct_storage:
+                recorded_filepath.unlink(missing_ok=True)
             raise RuntimeError(f'{target_program.radiko_title}: タグ設定でエラー') from e
         try:
-            moved_filepath = self._mv_file(target_program, recorded_filepath)
+            with phase('move', **labels) as m:
+                moved = self._mv_file(target_program, recorded_filepath)
+                m['bytes'] = moved.size
         except Exception as e:
             raise RuntimeError(f'{target_program.radiko_title}: NAS移動でエラー') from e
-        logger.info(f'file move to {moved_filepath}')
-        target_program.filepath = str(moved_filepath)
+        logger.info(f'file move to {moved.path} ({moved.size} bytes)')
+        target_program.filepath = str(moved.path)
+        target_program.filehash = moved.sha256
         return target_program
@@ -0,0 +1,29 @@
+import os
+import threading
+from pathlib import Path
+
+
+def write_atomic(path: Path, data: str | bytes, mode: int | None = None) -> None:
+    """同じフォルダの一時ファイルに書いて fsync し、rename で置き換える
+
+    読み手が書きかけの内容を見ることはなく、異常終了しても空のファイルは残らない。
+    mode を指定するとその権限で作る（既存のファイルを置き換える場合も）。未指定なら umask に従う。
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    # 同じファイルを複数のスレッド・プロセスが書いても一時ファイルが衝突しないようにする
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666 if mode is None else mode)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if mode is not None:
+                os.fchmod(f.fileno(), mode)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import getLogger
+from pathlib import Path
+import requests
+from ._fs import write_atomic
+
+
+logger = getLogger(__name__)
+
+
+class ArtworkCache:
+    """番組画像をURLごとに保持するサイズ上限付きキャッシュ
+
+    画像本体は内容のSHA-256で保存し、同じ画像を指す複数のURLで共有する。
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 50 * 1024 * 1024, ttl: int = 24 * 60 * 60,
+                 timeout: float = 10.0, workers: int = 2):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.timeout = timeout
+        self.workers = workers
+        self._lock = threading.RLock()
+        self._inflight: dict[str, Future] = {}
+        self._executor: ThreadPoolExecutor | None = None
+        self._index = self._load_index()
+
+    @property
+    def _index_path(self) -> Path:
+        return self.cache_dir / 'index.json'
+
+    def _blob_path(self, sha256: str) -> Path:
+        return self.cache_dir / 'blobs' / sha256
+
+    def _load_index(self) -> dict:
+        try:
+            return json.loads(self._index_path.read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_index(self) -> None:
+        write_atomic(self._index_path, json.dumps(self._index, ensure_ascii=False))
+
+    def _read_blob(self, entry: dict | None) -> bytes | None:
+        if not entry:
+            return None
+        try:
+            return self._blob_path(entry['sha256']).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _store(self, url: str, content: bytes, etag: str, last_modified: str) -> None:
+        sha256 = hashlib.sha256(content).hexdigest()
+        blob = self._blob_path(sha256)
+        if not blob.exists():
+            write_atomic(blob, content)
+        self._index[url] = {
+            'sha256': sha256,
+            'size': len(content),
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': time.time(),
+            'used_at': time.time(),
+        }
+        self._evict()
+
+    def _evict(self) -> None:
+        # 最後に使われた時刻が古いURLから外し、どのURLからも参照されない画像を削除する
+        sizes = {entry['sha256']: entry['size'] for entry in self._index.values()}
+        total = sum(sizes.values())
+        for url, entry in sorted(self._index.items(), key=lambda item: item[1]['used_at']):
+            if total <= self.max_bytes:
+                break
+            del self._index[url]
+            if all(other['sha256'] != entry['sha256'] for other in self._index.values()):
+                total -= entry['size']
+                self._blob_path(entry['sha256']).unlink(missing_ok=True)
+
+    def _fetch(self, session: requests.Session, url: str) -> bytes:
+        with self._lock:
+            entry = self._index.get(url)
+            cached = self._read_blob(entry)
+            if cached is not None and time.time() - entry['fetched_at'] < self.ttl:
+                entry['used_at'] = time.time()
+                self._save_index()
+                return cached
+
+        headers = {}
+        if cached is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and cached is not None:
+                content = cached
+            elif response.status_code == 200:
+                content = response.content
+            else:
+                raise requests.HTTPError(f'Failed to download JPEG file. Status code: {response.status_code}')
+        except requests.RequestException as e:
+            if cached is None:
+                raise
+            logger.warning(f'failed to fetch artwork {url}, using cached image: {e}')
+            return cached
+
+        with self._lock:
+            self._store(url, content, response.headers.get('ETag', ''), response.headers.get('Last-Modified', ''))
+            self._save_index()
+        return content
+
+    def get(self, session: requests.Session, url: str) -> bytes:
+        with self._lock:
+            future = self._inflight.get(url)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                pass
+        return self._fetch(session, url)
+
+    def prefetch(self, session: requests.Session, urls: list[str]) -> None:
+        """録音と並行して画像をバックグラウンドで取得しておく"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='artwork')
+            for url in dict.fromkeys(urls):
+                if url and url not in self._inflight:
+                    future = self._executor.submit(self._fetch, session, url)
+                    self._inflight[url] = future
+                    future.add_done_callback(lambda _, url=url: self._done(url))
+
+    def _done(self, url: str) -> None:
+        with self._lock:
+            self._inflight.pop(url, None)
@@ -4,9 +4,12 @@ import tempfile
 
 
 class AudioConcatenator:
-    def __init__(self, output_file: str | Path = 'output.m4a'):
+    def __init__(self, output_file: str | Path = 'output.m4a', faststart: bool = True):
         self.output_file: Path = Path(output_file)
         self.file_list: list[Path] = []
+        self.metadata: dict[str, str] = {}
+        self.cover: bytes = b''
+        self.faststart = faststart
 
     def add_file(self, file_path: Path) -> None:
         """結合するファイルを追加"""
@@ -15,6 +18,30 @@ class AudioConcatenator:
         else:
             raise FileNotFoundError(f'ファイルが見つかりません: {file_path}')
 
+    def set_metadata(self, **tags: str) -> None:
+        """結合と同時に書き込むタグ(album, title, artist など)を設定"""
+        self.metadata.update({key: value for key, value in tags.items() if value})
+
+    def set_cover(self, image: bytes) -> None:
+        """結合と同時に埋め込むカバー画像を設定"""
+        self.cover = image
+
+    def _cover_suffix(self) -> str:
+        return '.png' if self.cover.startswith(b'\x89PNG') else '.jpg'
+
+    def _command(self, list_file: Path, cover_file: Path | None) -> list:
+        command = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_file]
+        if cover_file:
+            command += ['-i', cover_file, '-map', '0:a', '-map', '1:v', '-c', 'copy', '-disposition:v:0', 'attached_pic']
+        else:
+            command += ['-c', 'copy']
+        for key, value in self.metadata.items():
+            command += ['-metadata', f'{key}={value}']
+        if self.faststart:
+            command += ['-movflags', '+faststart']
+        command.append(self.output_file)
+        return command
+
     def concatenate(self) -> None:
         """ファイルを結合"""
         if len(self.file_list) < 2:
@@ -26,12 +53,15 @@ class AudioConcatenator:
                 temp_file.write(f"file '{file}'\n")
             temp_file_path = Path(temp_file.name)
 
+        cover_file_path: Path | None = None
+        if self.cover:
+            with tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix=self._cover_suffix()) as cover_file:
+                cover_file.write(self.cover)
+                cover_file_path = Path(cover_file.name)
+
         try:
-            # ffmpeg で結合
-            subprocess.run(
-                ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', temp_file_path, '-c', 'copy', self.output_file],
-                check=True
-            )
+            # ffmpeg で結合（タグ・カバー・faststart も同じパスで書き込む）
+            subprocess.run(self._command(temp_file_path, cover_file_path), check=True)
 
         except subprocess.CalledProcessError as e:
             raise ValueError(f'ffmpeg でエラーが発生しました: {e}') from e
@@ -39,3 +69,5 @@ class AudioConcatenator:
         finally:
             # 一時ファイルを削除
             temp_file_path.unlink()
+            if cover_file_path:
+                cover_file_path.unlink()
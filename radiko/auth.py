@@ -0,0 +1,95 @@
+import hashlib
+import json
+import threading
+import time
+from logging import getLogger
+from pathlib import Path
+import requests
+from ._fs import write_atomic
+from .hls_downloader import DownloadError, HlsDownloader
+
+
+logger = getLogger(__name__)
+
+
+class RadikoAuth:
+    """radiko の認証トークンを1回の実行（常駐中はその間）の全録音で共有する
+
+    ログインと auth1/auth2 は必要なときに1度だけ行い、トークンは有効期限と一緒にディスク(0600)に保存して
+    次回の実行でも使う。期限の refresh_margin 秒前になったら取り直す。
+    """
+
+    # radiko は有効期限を返さないため、実測より短めにしておく
+    TOKEN_TTL = 60 * 60
+    REFRESH_MARGIN = 5 * 60
+
+    def __init__(self, downloader: HlsDownloader, email: str = '', password: str = '',
+                 cache_file: Path | None = None, ttl: float = TOKEN_TTL, refresh_margin: float = REFRESH_MARGIN):
+        self.downloader = downloader
+        self.email = email
+        self.password = password
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token = ''
+        self._radiko_session = ''
+        self._expires_at = 0.0
+
+    def _account(self) -> str:
+        # 別のアカウントで保存したトークンは使わない（メールアドレスそのものは保存しない）
+        return hashlib.sha256(self.email.encode('utf-8')).hexdigest()
+
+    def _fresh(self) -> bool:
+        return bool(self._token) and time.time() < self._expires_at - self.refresh_margin
+
+    def _load(self) -> None:
+        if not self.cache_file:
+            return
+        try:
+            data = json.loads(self.cache_file.read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get('account') != self._account():
+            return
+        self._token = data.get('token', '')
+        self._radiko_session = data.get('radiko_session', '')
+        self._expires_at = float(data.get('expires_at', 0))
+
+    def _save(self) -> None:
+        if not self.cache_file:
+            return
+        data = json.dumps({'account': self._account(), 'token': self._token,
+                           'radiko_session': self._radiko_session, 'expires_at': self._expires_at})
+        write_atomic(self.cache_file, data, mode=0o600)
+
+    def token(self) -> str:
+        with self._lock:
+            if self._fresh():
+                return self._token
+            self._load()
+            if self._fresh():
+                logger.debug('using cached radiko token')
+                return self._token
+            if self.email and self.password and not self._radiko_session:
+                self._radiko_session = self.downloader.login(self.email, self.password)
+            try:
+                self._token = self.downloader.authenticate(self._radiko_session)
+            except (DownloadError, requests.RequestException):
+                if not self._radiko_session:
+                    raise
+                # ログインの期限切れに備えて1度だけログインし直す
+                self._radiko_session = self.downloader.login(self.email, self.password)
+                self._token = self.downloader.authenticate(self._radiko_session)
+            self._expires_at = time.time() + self.ttl
+            logger.info('authenticated to radiko')
+            self._save()
+            return self._token
+
+    def invalidate(self) -> None:
+        """トークンが拒否されたときに呼ぶ。次の token() で取り直す"""
+        with self._lock:
+            self._token = ''
+            self._expires_at = 0.0
+            if self.cache_file:
+                self.cache_file.unlink(missing_ok=True)
@@ -0,0 +1,118 @@
+import errno
+import hashlib
+import os
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class MoveResult:
+    path: Path
+    size: int
+    sha256: str = ''
+    renamed: bool = False
+
+
+class FileMover:
+    """録音ファイルを保存先へ移動する
+
+    同一ファイルシステムなら rename のみ。異なる場合は保存先ディレクトリ内の一時ファイルへコピーし、
+    サイズを検証してから rename で公開するため、途中で失敗しても書きかけのファイルは残らない。
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, fsync: bool = False, checksum: bool = True):
+        self.fsync = fsync
+        self.checksum = checksum
+
+    def move(self, src: Path, dst: Path) -> MoveResult:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        stat = src.stat()
+        size = stat.st_size
+        if stat.st_dev == dst.parent.stat().st_dev:
+            try:
+                os.replace(src, dst)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+            else:
+                if self.fsync:
+                    self._fsync_dir(dst.parent)
+                # rename ではデータを読まない。ハッシュはコピーと同時に計算できる場合だけ求める
+                return MoveResult(dst, size, renamed=True)
+
+        tmp = dst.with_name(f'.{dst.name}.{os.getpid()}.partial')
+        try:
+            with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+                if self.checksum:
+                    sha256 = self._copy_with_hash(fin, fout)
+                else:
+                    sha256 = ''
+                    self._copy_in_kernel(fin, fout, size)
+                if self.fsync:
+                    fout.flush()
+                    os.fsync(fout.fileno())
+            copied = tmp.stat().st_size
+            if copied != size:
+                raise OSError(f'size mismatch after copy: {copied} != {size} ({dst})')
+            os.replace(tmp, dst)
+            if self.fsync:
+                self._fsync_dir(dst.parent)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        src.unlink()
+        return MoveResult(dst, size, sha256)
+
+    def _copy_with_hash(self, fin, fout) -> str:
+        # 読み込んだバッファをそのままハッシュと書き込みに使い、1回の読み込みで済ませる
+        digest = hashlib.sha256()
+        buf = bytearray(self.CHUNK_SIZE)
+        view = memoryview(buf)
+        while True:
+            n = fin.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+            fout.write(view[:n])
+        return digest.hexdigest()
+
+    def _copy_in_kernel(self, fin, fout, size: int) -> None:
+        # copy_file_range → sendfile の順に試し、ユーザ空間を経由せずにコピーする
+        infd, outfd = fin.fileno(), fout.fileno()
+        offset = 0
+        for copy in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+            if copy is None:
+                continue
+            # sendfile は出力側の現在位置に書き込むため、直前の試行で進んだ位置に合わせる
+            os.lseek(outfd, offset, os.SEEK_SET)
+            try:
+                while offset < size:
+                    if copy is os.sendfile:
+                        n = os.sendfile(outfd, infd, offset, min(size - offset, 1 << 30))
+                    else:
+                        n = os.copy_file_range(infd, outfd, min(size - offset, 1 << 30), offset, offset)
+                    if n == 0:
+                        break
+                    offset += n
+                if offset >= size:
+                    return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+        fin.seek(offset)
+        fout.seek(offset)
+        while chunk := fin.read(self.CHUNK_SIZE):
+            fout.write(chunk)
+
+    def _fsync_dir(self, directory: Path) -> None:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,185 @@
+import base64
+import subprocess
+import threading
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import getLogger
+from pathlib import Path
+from urllib.parse import urlencode, urljoin
+import requests
+
+
+logger = getLogger(__name__)
+
+
+class DownloadError(Exception):
+    pass
+
+
+class AuthError(DownloadError):
+    """認証トークンが拒否された"""
+
+
+class FfmpegMuxer:
+    """AAC(ADTS) のバイト列を標準入力で受け取り、ffmpeg で m4a に格納する"""
+
+    def __init__(self, output: Path):
+        self.output = output
+        self.proc = subprocess.Popen(
+            ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'aac', '-i', 'pipe:0',
+             '-c', 'copy', '-bsf:a', 'aac_adtstoasc', str(output)],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True)
+
+    def write(self, data: bytes) -> None:
+        assert self.proc.stdin is not None
+        self.proc.stdin.write(data)
+
+    def close(self) -> None:
+        assert self.proc.stdin is not None
+        self.proc.stdin.close()
+        _, stderr = self.proc.communicate()
+        if self.proc.returncode != 0:
+            raise DownloadError(f'ffmpeg failed: {stderr.decode(errors="replace").strip()}')
+
+    def abort(self) -> None:
+        self.proc.kill()
+        self.proc.communicate()
+
+
+class HlsDownloader:
+    """rec_radiko_ts.sh を使わずにタイムフリーを録音する
+
+    auth1/auth2 で認証し、タイムフリーのプレイリストにある AAC セグメントを接続プール上で並列に取得して、
+    番組の順に muxer(既定は ffmpeg の標準入力)へ流し込む。
+    """
+
+    # radiko の HTML5 プレーヤーに埋め込まれている公開鍵
+    AUTH_KEY = 'bcd151073c03b352e1ef2fd66c32209da9ca0afa'
+    AUTH_HEADERS = {
+        'X-Radiko-App': 'pc_html5',
+        'X-Radiko-App-Version': '0.0.1',
+        'X-Radiko-User': 'dummy_user',
+        'X-Radiko-Device': 'pc',
+    }
+    DEFAULT_WORKERS = 4
+
+    def __init__(self, session: requests.Session, base_url: str = 'https://radiko.jp', workers: int = DEFAULT_WORKERS,
+                 timeout: float = 10.0, retries: int = 3,
+                 muxer: Callable[[Path], FfmpegMuxer] = FfmpegMuxer,
+                 progress: Callable[[int, int, int], None] | None = None):
+        self.session = session
+        self.base_url = base_url.rstrip('/')
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.retries = retries
+        self.muxer = muxer
+        self.progress = progress
+        self._aborted = threading.Event()
+
+    def abort(self) -> None:
+        self._aborted.set()
+
+    def login(self, email: str, password: str) -> str:
+        """radiko プレミアムにログインし、radiko_session を返す"""
+        response = self.session.post(f'{self.base_url}/v4/api/member/login', data={'mail': email, 'pass': password},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        radiko_session = response.json().get('radiko_session', '')
+        if not radiko_session:
+            raise DownloadError('radiko login failed')
+        return radiko_session
+
+    def authenticate(self, radiko_session: str = '') -> str:
+        """auth1/auth2 を行い、認証トークンを返す"""
+        response = self.session.get(f'{self.base_url}/v2/api/auth1', headers=self.AUTH_HEADERS, timeout=self.timeout)
+        response.raise_for_status()
+        token = response.headers.get('X-Radiko-AuthToken', '')
+        offset = int(response.headers.get('X-Radiko-KeyOffset', 0))
+        length = int(response.headers.get('X-Radiko-KeyLength', 0))
+        if not token or not length:
+            raise DownloadError('auth1 returned no token')
+        partial_key = base64.b64encode(self.AUTH_KEY[offset:offset + length].encode()).decode()
+
+        url = f'{self.base_url}/v2/api/auth2'
+        if radiko_session:
+            url += '?' + urlencode({'radiko_session': radiko_session})
+        headers = {**self.AUTH_HEADERS, 'X-Radiko-AuthToken': token, 'X-Radiko-PartialKey': partial_key}
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        logger.debug(f'radiko area: {response.text.strip()}')
+        return token
+
+    def playlist_url(self, station: str, ft: str, to: str) -> str:
+        query = urlencode({'station_id': station, 'l': 15, 'ft': ft, 'to': to})
+        return f'{self.base_url}/v2/api/ts/playlist.m3u8?{query}'
+
+    def _get(self, url: str, token: str, cancel: threading.Event | None = None) -> requests.Response:
+        last_error: Exception | None = None
+        for _ in range(self.retries + 1):
+            if self._aborted.is_set() or (cancel and cancel.is_set()):
+                raise DownloadError('aborted')
+            try:
+                response = self.session.get(url, headers={'X-Radiko-AuthToken': token}, timeout=self.timeout)
+                if response.status_code in (401, 403):
+                    raise AuthError(f'token rejected ({response.status_code}): {url}')
+                response.raise_for_status()
+                return response
+            except requests.RequestException as e:
+                last_error = e
+        raise DownloadError(f'failed to get {url}: {last_error}')
+
+    def segments(self, url: str, token: str, cancel: threading.Event | None = None) -> list[str]:
+        """プレイリストを辿り、AAC セグメントの URL を再生順に返す"""
+        uris = []
+        for line in self._get(url, token, cancel).text.splitlines():
+            line = line.strip()
+            if line and not line.startswith('#'):
+                uris.append(urljoin(url, line))
+        ret = []
+        for uri in uris:
+            if uri.split('?', 1)[0].endswith('.m3u8'):
+                ret.extend(self.segments(uri, token, cancel))
+            else:
+                ret.append(uri)
+        return ret
+
+    def download(self, station: str, ft: str, to: str, output: Path, token: str,
+                 cancel: threading.Event | None = None) -> Path:
+        """[ft, to) を output に録音する。cancel がセットされたら中止する。失敗したら書きかけの output は消す"""
+        urls = self.segments(self.playlist_url(station, ft, to), token, cancel)
+        if not urls:
+            raise DownloadError(f'no segments for {station} {ft}-{to}')
+        logger.debug(f'downloading {len(urls)} segments of {station} {ft}-{to}')
+
+        muxer = self.muxer(output)
+        try:
+            self._stream(urls, token, muxer, cancel)
+            muxer.close()
+        except BaseException:
+            muxer.abort()
+            output.unlink(missing_ok=True)
+            raise
+        return output
+
+    def _stream(self, urls: list[str], token: str, muxer: FfmpegMuxer, cancel: threading.Event | None = None) -> None:
+        # 先読みは workers の2倍までにして、メモリに溜めるセグメント数を抑える
+        written = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending: deque[Future] = deque()
+            queued = 0
+            try:
+                for index in range(len(urls)):
+                    while queued < len(urls) and len(pending) < self.workers * 2:
+                        pending.append(executor.submit(lambda u: self._get(u, token, cancel).content, urls[queued]))
+                        queued += 1
+                    data = pending.popleft().result()
+                    muxer.write(data)
+                    written += len(data)
+                    if self.progress:
+                        self.progress(index + 1, len(urls), written)
+                    elif (index + 1) * 10 // len(urls) != index * 10 // len(urls):
+                        logger.debug(f'downloaded {index + 1}/{len(urls)} segments ({written} bytes)')
+            finally:
+                for future in pending:
+                    future.cancel()
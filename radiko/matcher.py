@@ -0,0 +1,134 @@
+import re
+from collections import deque
+from collections.abc import Callable
+from logging import getLogger
+
+
+logger = getLogger(__name__)
+
+NO_MATCH = float('inf')
+
+
+class _AhoCorasick:
+    """contains 用の多パターン照合オートマトン。各ノードには到達時に一致する最小ルール番号を持たせる"""
+
+    def __init__(self):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.out: list[float] = [NO_MATCH]
+
+    def add(self, word: str, index: int) -> None:
+        node = 0
+        for ch in word:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(NO_MATCH)
+            node = nxt
+        self.out[node] = min(self.out[node], index)
+
+    def build(self) -> None:
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                # 深さ1のノードの失敗遷移は根
+                self.fail[nxt] = self.goto[f].get(ch, 0) if node else 0
+                self.out[nxt] = min(self.out[nxt], self.out[self.fail[nxt]])
+
+    def search(self, text: str) -> float:
+        best = NO_MATCH
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            if self.out[node] < best:
+                best = self.out[node]
+        return best
+
+
+class _PrefixTrie:
+    def __init__(self):
+        self.root: dict = {}
+
+    def add(self, word: str, index: int) -> None:
+        node = self.root
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[None] = min(node.get(None, NO_MATCH), index)
+
+    def search(self, text: str) -> float:
+        best = NO_MATCH
+        node = self.root
+        for ch in text:
+            node = node.get(ch)
+            if node is None:
+                break
+            if node.get(None, NO_MATCH) < best:
+                best = node[None]
+        return best
+
+
+class TextMatcher:
+    """(ワード, 一致方法) のルール列をまとめて照合し、最初に一致したルールの番号を返す
+
+    regex 以外のワードは構築時に一度だけ正規化する。
+    """
+
+    def __init__(self, rules: list[tuple[str, str]], normalize: Callable[[str], str]):
+        self.rules = list(rules)
+        self.normalize = normalize
+        self._contains = _AhoCorasick()
+        self._prefix = _PrefixTrie()
+        self._exact: dict[str, int] = {}
+        self._regex: list[tuple[int, re.Pattern]] = []
+        self._has_normalized = False
+
+        for index, (word, mode) in enumerate(self.rules):
+            if mode == 'regex':
+                try:
+                    self._regex.append((index, re.compile(word, re.IGNORECASE)))
+                except re.error:
+                    logger.warning(f'invalid regex in words: {word}')
+                continue
+            normalized_word = normalize(word)
+            if not normalized_word:
+                continue
+            if mode == 'exact':
+                self._exact.setdefault(normalized_word, index)
+            elif mode == 'contains':
+                self._contains.add(normalized_word, index)
+            elif mode == 'prefix':
+                self._prefix.add(normalized_word, index)
+            else:
+                continue
+            self._has_normalized = True
+        self._contains.build()
+
+    def first_match(self, *texts: str) -> int | None:
+        """いずれかのテキストに一致する最小のルール番号。一致しなければ None"""
+        best = NO_MATCH
+        for text in texts:
+            if self._has_normalized:
+                normalized = self.normalize(text)
+                best = min(best,
+                           self._exact.get(normalized, NO_MATCH),
+                           self._contains.search(normalized),
+                           self._prefix.search(normalized))
+            for index, pattern in self._regex:
+                if index >= best:
+                    break
+                if pattern.search(text):
+                    best = index
+                    break
+        if best == NO_MATCH:
+            return None
+        return int(best)
@@ -0,0 +1,60 @@
+import hashlib
+import json
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from logging import getLogger
+from pathlib import Path
+from ._fs import write_atomic
+
+
+logger = getLogger(__name__)
+
+
+class PlanCache:
+    """前回の番組表の各番組(prog)に対する抽出結果を局ごとにディスクに保持する
+
+    番組は (station, ft, to, title, img, pfm) の指紋で、ルールは radio.yaml 全体のハッシュで識別する。
+    ルールが変わった局の結果は使わない。今回の対象期間外の結果は残し、終了から retention_days を過ぎたら消す。
+    """
+
+    VERSION = 2
+    # タイムフリーの保持期間(7日)より長くしておく
+    RETENTION_DAYS = 8
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def fingerprint(entry: tuple[str, ...]) -> str:
+        return hashlib.blake2b('\t'.join(entry).encode('utf-8'), digest_size=12).hexdigest()
+
+    @classmethod
+    def config_hash(cls, radio: list) -> str:
+        text = json.dumps([cls.VERSION, radio], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _path(self, station: str) -> Path:
+        return self.cache_dir / f'{station}.json'
+
+    def load(self, station: str, config_hash: str) -> dict[str, list]:
+        """指紋 → [ft, to, 抽出結果(Program の dict、一致なしは None)]。ルールが変わっていれば空"""
+        try:
+            data = json.loads(self._path(station).read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            return {}
+        if data.get('config') != config_hash:
+            logger.debug(f'plan cache invalidated: {station}')
+            return {}
+        return data.get('entries', {})
+
+    def store(self, station: str, config_hash: str, entries: dict, previous: dict | None = None,
+              window: tuple[str, str] | None = None) -> None:
+        """entries は指紋 → (ft, to, Program か None)。previous のうち window 外でまだ古くないものは残す"""
+        stored = {fp: [ft, to, asdict(pg) if pg is not None else None] for fp, (ft, to, pg) in entries.items()}
+        if previous and window is not None:
+            cutoff = (datetime.now() - timedelta(days=self.RETENTION_DAYS)).strftime('%Y%m%d%H%M%S')
+            for fp, (ft, to, pg) in previous.items():
+                if fp not in stored and not window[0] <= ft < window[1] and to >= cutoff:
+                    stored[fp] = [ft, to, pg]
+        data = {'config': config_hash, 'entries': stored}
+        write_atomic(self._path(station), json.dumps(data, ensure_ascii=False, separators=(',', ':')))
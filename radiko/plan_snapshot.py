@@ -0,0 +1,64 @@
+import hashlib
+import json
+import time
+from dataclasses import asdict
+from logging import getLogger
+from pathlib import Path
+from ._fs import write_atomic
+
+
+logger = getLogger(__name__)
+
+
+class PlanSnapshot:
+    """get_programs の結果(録音予定)を radio.yaml と対象期間ごとにディスクに保持する
+
+    作成時の番組表キャッシュのハッシュも保存し、radio.yaml・番組表・対象期間のどれかが変わったか、
+    ttl 秒を過ぎたものは使わない。--list-upcoming や --status は、使えれば番組表を取得せずにこれを表示する。
+    """
+
+    VERSION = 1
+
+    def __init__(self, cache_dir: Path, ttl: int = 3600):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+
+    def _path(self, config_hash: str, window: tuple[str, str] | None) -> Path:
+        text = json.dumps([self.VERSION, config_hash, window])
+        return self.cache_dir / f'{hashlib.blake2b(text.encode("utf-8"), digest_size=12).hexdigest()}.json'
+
+    def load(self, config_hash: str, window: tuple[str, str] | None, schedule_digest: str) -> dict | None:
+        """キー → Program の dict か、分割番組なら dict のリスト。使えなければ None"""
+        if self.ttl <= 0:
+            return None
+        try:
+            data = json.loads(self._path(config_hash, window).read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get('schedule') != schedule_digest:
+            logger.debug('plan snapshot outdated: schedule changed')
+            return None
+        if time.time() - data.get('created_at', 0) >= self.ttl:
+            logger.debug('plan snapshot expired')
+            return None
+        return data.get('programs')
+
+    def store(self, config_hash: str, window: tuple[str, str] | None, schedule_digest: str, programs: dict) -> None:
+        if self.ttl <= 0:
+            return
+        now = time.time()
+        data = {
+            'schedule': schedule_digest,
+            'created_at': now,
+            'programs': {key: [asdict(pg) for pg in program] if isinstance(program, list) else asdict(program)
+                         for key, program in programs.items()},
+        }
+        path = self._path(config_hash, window)
+        write_atomic(path, json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+        # 日付が変わると対象期間も変わるため、期限切れの他の期間のものは消す
+        for other in self.cache_dir.glob('*.json'):
+            try:
+                if other != path and now - other.stat().st_mtime >= self.ttl:
+                    other.unlink()
+            except OSError:
+                pass
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from logging import getLogger
+
+
+logger = getLogger(__name__)
+
+
+class RateLimiter:
+    """radiko へのリクエスト間隔を全ジョブで共有し、失敗が続いたら間隔を広げる"""
+
+    def __init__(self, min_interval: float = 0.0, max_backoff: float = 300.0):
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        self._backoff = 0.0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+        self._aborted = threading.Event()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._next_at - now)
+            self._next_at = max(now, self._next_at) + self.min_interval + self._backoff
+        # abort() されたら待たずに戻る（この後の録音は呼び出し側で中止される）
+        if delay:
+            self._aborted.wait(delay)
+
+    def abort(self) -> None:
+        self._aborted.set()
+
+    def success(self) -> None:
+        with self._lock:
+            self._backoff = 0.0
+
+    def failure(self) -> None:
+        with self._lock:
+            self._backoff = min(self.max_backoff, max(1.0, self.min_interval, self._backoff * 2))
+            logger.warning(f'radiko request failed, backoff {self._backoff:.0f}s')
+
+
+@dataclass
+class RecordingResult:
+    key: str
+    program: object
+    recorded: object = None
+    error: Exception | None = None
+
+
+class RecordingExecutor:
+    """複数の録音ジョブを全体・局ごとの同時実行数の上限内で並列実行する"""
+
+    def __init__(self, record: Callable, max_workers: int = 1, per_station: int = 1,
+                 stop: threading.Event | None = None):
+        self.record = record
+        self.max_workers = max(1, max_workers)
+        self.per_station = max(1, per_station)
+        # セットされたら待機中のジョブは投入せず、実行中のものが終わるのを待って終える
+        self.stop = stop or threading.Event()
+
+    def _station(self, program) -> str:
+        if isinstance(program, list):
+            return program[0].station
+        return program.station
+
+    def run(self, jobs: list[tuple[str, object]]) -> Iterator[RecordingResult]:
+        """ジョブを投入し、完了したものから順に結果を返す。結果は呼び出し元のスレッドで処理できる"""
+        pending = deque(jobs)
+        running: dict[Future, tuple[str, object, str]] = {}
+        station_running: dict[str, int] = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if self.stop.is_set():
+                    if pending:
+                        logger.info(f'stopped, skipping {len(pending)} queued recordings')
+                    pending.clear()
+                    if not running:
+                        break
+                deferred = deque()
+                while pending and len(running) < self.max_workers:
+                    key, program = pending.popleft()
+                    station = self._station(program)
+                    if station_running.get(station, 0) >= self.per_station:
+                        deferred.append((key, program))
+                        continue
+                    station_running[station] = station_running.get(station, 0) + 1
+                    running[executor.submit(self.record, program)] = (key, program, station)
+                pending = deferred + pending
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, program, station = running.pop(future)
+                    station_running[station] -= 1
+                    try:
+                        result = RecordingResult(key, program, recorded=future.result())
+                    except Exception as e:
+                        result = RecordingResult(key, program, error=e)
+                    yield result
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import time
+from logging import getLogger
+from pathlib import Path
+import requests
+from ._fs import write_atomic
+
+
+logger = getLogger(__name__)
+
+
+class ScheduleCache:
+    """局ごとの週間番組表XMLをETag/Last-Modified付きでディスクに保持する"""
+
+    def __init__(self, cache_dir: Path, ttl: int = 600):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+
+    def _xml_path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}.xml'
+
+    def _meta_path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}.json'
+
+    def _load_meta(self, key: str) -> dict | None:
+        if not self._xml_path(key).exists():
+            return None
+        try:
+            return json.loads(self._meta_path(key).read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _content_digest(xml: str) -> str:
+        return hashlib.blake2b(xml.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _store(self, key: str, xml: str, meta: dict) -> None:
+        if not meta.get('digest'):
+            meta['digest'] = self._content_digest(xml)
+        write_atomic(self._xml_path(key), xml)
+        write_atomic(self._meta_path(key), json.dumps(meta, ensure_ascii=False))
+
+    def get(self, session: requests.Session, url: str, key: str, timeout: float) -> str:
+        """キャッシュが有効期間内ならそのまま返し、期限切れなら条件付きGETで再検証する"""
+        return self.get_path(session, url, key, timeout).read_text(encoding='utf-8')
+
+    def get_path(self, session: requests.Session, url: str, key: str, timeout: float) -> Path:
+        """get と同じだが、XML を読み込まずにキャッシュしたファイルのパスを返す（少しずつ解析する用）"""
+        meta = self._load_meta(key)
+        now = time.time()
+        if meta and now - meta.get('fetched_at', 0) < self.ttl:
+            logger.debug(f'schedule cache hit: {key}')
+            return self._xml_path(key)
+
+        headers = {'Accept-Encoding': 'gzip'}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            response = session.get(url, headers=headers, timeout=timeout)
+            if response.status_code != 304 or not meta:
+                response.raise_for_status()
+        except requests.RequestException as e:
+            if not meta:
+                raise
+            logger.warning(f'failed to fetch {url}, using stale schedule cache: {e}')
+            return self._xml_path(key)
+
+        if response.status_code == 304 and meta:
+            # 変わっていなければ XML は書き直さず、再検証の時刻だけ更新する
+            logger.debug(f'schedule not modified: {key}')
+            meta['fetched_at'] = now
+            if not meta.get('digest'):
+                meta['digest'] = self._content_digest(self._xml_path(key).read_text(encoding='utf-8'))
+            write_atomic(self._meta_path(key), json.dumps(meta, ensure_ascii=False))
+            return self._xml_path(key)
+
+        meta = {
+            'etag': response.headers.get('ETag', ''),
+            'last_modified': response.headers.get('Last-Modified', ''),
+            'fetched_at': now,
+        }
+        self._store(key, response.text, meta)
+        return self._xml_path(key)
+
+    def digest(self) -> str:
+        """保持している全番組表の内容のハッシュ。内容が変わったときだけ変わる（再検証の時刻には依存しない）"""
+        digest = hashlib.blake2b(digest_size=16)
+        for meta_path in sorted(self.cache_dir.glob('*.json')):
+            key = meta_path.stem
+            try:
+                content = json.loads(meta_path.read_text(encoding='utf-8')).get('digest')
+                if not content:
+                    content = self._content_digest(self._xml_path(key).read_text(encoding='utf-8'))
+            except (FileNotFoundError, ValueError):
+                continue
+            digest.update(f'{key}\t{content}\n'.encode('utf-8'))
+        return digest.hexdigest()
@@ -0,0 +1,64 @@
+import sys
+from array import array
+from collections.abc import Iterable, Iterator
+from .matcher import TextMatcher
+
+
+class ScheduleTable:
+    """番組表を列ごとの配列で持つ。文字列は表の中で1つにまとめ、番号で参照する
+
+    全国の局の番組表を検索ワードだけで探すときに使う。Program は一致した行についてだけ作る。
+    """
+
+    def __init__(self):
+        self._strings: list[str] = []
+        self._ids: dict[str, int] = {}
+        self.station = array('I')
+        self.start_at = array('q')
+        self.end_at = array('q')
+        self.title = array('I')
+        self.img = array('I')
+        self.pfm = array('I')
+
+    def __len__(self) -> int:
+        return len(self.start_at)
+
+    def _intern(self, text: str) -> int:
+        sid = self._ids.get(text)
+        if sid is None:
+            sid = len(self._strings)
+            self._strings.append(sys.intern(text))
+            self._ids[text] = sid
+        return sid
+
+    def append(self, station: str, start_at: int, end_at: int, title: str, img: str, pfm: str) -> None:
+        self.station.append(self._intern(station))
+        self.start_at.append(start_at)
+        self.end_at.append(end_at)
+        self.title.append(self._intern(title))
+        self.img.append(self._intern(img))
+        self.pfm.append(self._intern(pfm))
+
+    def row(self, index: int) -> tuple[str, int, int, str, str, str]:
+        s = self._strings
+        return (s[self.station[index]], self.start_at[index], self.end_at[index],
+                s[self.title[index]], s[self.img[index]], s[self.pfm[index]])
+
+    def rows(self, indexes: Iterable[int]) -> Iterator[tuple[str, int, int, str, str, str]]:
+        for index in indexes:
+            yield self.row(index)
+
+    def match(self, matchers: Iterable[TextMatcher]) -> list[int]:
+        """タイトルか出演者がいずれかの matcher に一致する行番号。照合は異なる文字列ごとに1回だけ行う"""
+        matchers = list(matchers)
+        hit = bytearray(len(self._strings))
+        for sid in set(self.title).union(self.pfm):
+            text = self._strings[sid]
+            hit[sid] = any(matcher.first_match(text) is not None for matcher in matchers)
+        return [i for i, (title, pfm) in enumerate(zip(self.title, self.pfm)) if hit[title] or hit[pfm]]
+
+    def nbytes(self) -> int:
+        """列の配列と文字列の概算メモリ量"""
+        columns = (self.station, self.start_at, self.end_at, self.title, self.img, self.pfm)
+        return (sum(column.itemsize * len(column) for column in columns)
+                + sum(sys.getsizeof(text) for text in self._strings))
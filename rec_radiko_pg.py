@@ -4,15 +4,19 @@ from pathlib import Path
 from datetime import datetime, timedelta
 import argparse
 import logging
-import logging.config
-from gmail import Email
+import signal
+import threading
+import time
+import warnings
+from typing import TYPE_CHECKING
 from config_loader import ConfigLoader
 from latest import Latest
-from radiko import Radiko, Program, normalize_text
-import warnings
+from metrics import metrics
+from radiko import (ArtworkCache, FileMover, HlsDownloader, PlanCache, PlanSnapshot, Radiko, Program, RateLimiter, RecordingExecutor,
+                    ScheduleCache, epoch_to_datetime, normalize_text)
 
-
-warnings.filterwarnings("ignore", category=SyntaxWarning, module='pydub.utils')
+if TYPE_CHECKING:
+    from gmail import MailDispatcher
 
 
 @dataclass
@@ -24,21 +28,58 @@ class Config:
     gmail_receiver: str
     storage_dir: Path
     rec_radiko_ts_sh: Path
+    fetch_workers: int = Radiko.DEFAULT_FETCH_WORKERS
+    http_timeout: float = Radiko.DEFAULT_HTTP_TIMEOUT
+    schedule_cache_ttl: int = 600
+    incremental_plan: bool = True
+    plan_snapshot_ttl: int = 3600
+    record_workers: int = 1
+    record_workers_per_station: int = 1
+    radiko_request_interval: float = 2.0
+    record_part_workers: int = Radiko.DEFAULT_PART_WORKERS
+    segment_minutes: int = 0
+    segment_workers: int = Radiko.DEFAULT_SEGMENT_WORKERS
+    record_backend: str = 'shell'
+    download_workers: int = HlsDownloader.DEFAULT_WORKERS
+    storage_fsync: bool = False
+    storage_checksum: bool = True
+    storage_direct: bool = False
+    artwork_cache_max_mb: int = 50
+    state_backend: str = 'sqlite'
+    daemon_refresh_minutes: int = 60
+    metrics_textfile: str = ''
+    mail_digest_seconds: float = 60.0
 
 
 script_dir = Path(__file__).resolve().parent
+DAEMON_RETRY_SECONDS = 30 * 60
 
 
 def setup_logging():
+    import logging.config
+
     logger_yml = script_dir / 'logger.yaml'
     with open(logger_yml, 'r', encoding='utf-8') as f:
         config = yaml.safe_load(f.read())
         logging.config.dictConfig(config)
 
 
-setup_logging()
+# 設定・ログの読み込みは main() で行い、import 時には副作用を持たせない
 logger = logging.getLogger('rec_radiko_pg')
-config = ConfigLoader.load(script_dir / 'config.yaml', Config)
+config: Config
+
+
+def load_config() -> Config:
+    return ConfigLoader.load(script_dir / 'config.yaml', Config)
+
+
+def create_email() -> 'MailDispatcher':
+    # smtplib/email.mime はメールを送るときだけ読み込む
+    from gmail import MailDispatcher
+
+    # 録音処理がメール送信を待たないよう、送信はバックグラウンドで行う
+    return MailDispatcher(config.gmail_sender, config.gmail_pw, config.gmail_receiver, script_dir / 'spool' / 'mail',
+                          digest_seconds=config.mail_digest_seconds)
 
 
 def load_radio() -> list:
@@ -80,10 +121,8 @@ def _program_start_end(program: Program) -> tuple[Program, Program]:
     return program, program
 
 
-def _format_program_window(start: str, end: str) -> tuple[str, str]:
-    s = datetime.strptime(start, '%Y%m%d%H%M%S')
-    e = datetime.strptime(end, '%Y%m%d%H%M%S')
-    return s.strftime('%Y-%m-%d %H:%M'), e.strftime('%H:%M')
+def _format_program_window(start: Program, end: Program) -> tuple[str, str]:
+    return start.start_datetime.strftime('%Y-%m-%d %H:%M'), end.end_datetime.strftime('%H:%M')
 
 
 def _show_filename_hint(pg: Program) -> bool:
@@ -94,6 +133,29 @@ def _show_filename_hint(pg: Program) -> bool:
     return title_norm not in filename_norm
 
 
+def plan_window(n: datetime, list_upcoming: bool, list_days: int, since: str | None) -> tuple[str, str]:
+    """番組表の解析対象とする開始時刻の範囲 [from, to) を日単位で返す
+
+    同日内の番組は分割・重複判定でまとめて扱うため、日の途中で切らない。
+    """
+    if list_upcoming:
+        start = n
+        end = n + timedelta(days=list_days)
+    else:
+        start = n - timedelta(days=Radiko.TIMEFREE_RETENTION_DAYS)
+        if since:
+            start = max(start, datetime.strptime(since, '%Y%m%d%H%M%S'))
+        end = n
+    return start.strftime('%Y%m%d000000'), (end + timedelta(days=1)).strftime('%Y%m%d000000')
+
+
+def status_window(n: datetime) -> tuple[str, str]:
+    """--status の対象期間。録音待ち(タイムフリーの保持期間内)と、今日・明日の放送を含める"""
+    start, _ = plan_window(n, False, 0, None)
+    _, end = plan_window(n, True, 1, None)
+    return start, end
+
+
 def show_upcoming(programs: dict, latest: Latest, now: datetime, days: int) -> None:
     limit = now + timedelta(days=days)
     items = []
@@ -108,83 +170,271 @@ def show_upcoming(programs: dict, latest: Latest, now: datetime, days: int) -> N
             continue
         if pgs.start_time <= latest.get(pgs):
             continue
-        items.append((pgs.start_time, pge.end_time, pgs, program))
+        items.append((pgs.start_at, pge, pgs, program))
 
     items.sort(key=lambda x: x[0])
     print(f'録音予定件数: {len(items)} (対象期間: {days}日)')
-    for start, end, pg, program in items:
-        s, e = _format_program_window(start, end)
+    for _, pge, pg, program in items:
+        s, e = _format_program_window(pg, pge)
         print(f'{s}-{e} [{pg.station}] {pg.radiko_title}')
         if _show_filename_hint(pg):
             print(f'  -> 実際のファイル名: {pg.filename}')
         if isinstance(program, list):
             print('  連結対象:')
             for part in program:
-                ps, pe = _format_program_window(part.start_time, part.end_time)
+                ps, pe = _format_program_window(part, part)
                 print(f'    - {ps}-{pe} [{part.station}] {part.radiko_title}')
 
 
+def show_status(programs: dict, latest: Latest, now: datetime) -> None:
+    """録音待ちの番組と、これから録音可能になる番組を表示する"""
+    pending = recordable_programs(programs, latest, now)
+    print(f'録音待ち件数: {len(pending)}')
+    for program in sorted(pending.values(), key=lambda p: _program_start_end(p)[0].start_at):
+        pgs, pge = _program_start_end(program)
+        s, e = _format_program_window(pgs, pge)
+        print(f'{s}-{e} [{pgs.station}] {pgs.radiko_title}')
+
+    items = []
+    for program in programs.values():
+        pgs, pge = _program_start_end(program)
+        if pgs.start_time <= latest.get(pgs):
+            continue
+        at = epoch_to_datetime(pge.end_at) + timedelta(minutes=5)
+        if at > now:
+            items.append((at, pgs, pge))
+    items.sort(key=lambda x: x[0])
+    print(f'録音予定件数: {len(items)}')
+    for at, pgs, pge in items:
+        s, e = _format_program_window(pgs, pge)
+        print(f'{at:%Y-%m-%d %H:%M} 録音開始 {s}-{e} [{pgs.station}] {pgs.radiko_title}')
+
+
+def plan_programs(radiko: Radiko, window: tuple[str, str], full_replan: bool) -> dict:
+    """表示用の番組一覧。radio.yaml・番組表・対象期間が前回から変わっていなければ保存済みの結果を使う"""
+    radio = load_radio()
+    if not full_replan:
+        programs = radiko.cached_programs(radio, window)
+        if programs is not None:
+            logger.info(f'using plan snapshot ({len(programs)} programs)')
+            return programs
+    return radiko.get_programs(radio, window, full_replan)
+
+
+def create_radiko() -> Radiko:
+    if len(config.rec_radiko_ts_sh.parts) > 1:
+        rec_radiko_ts_sh = config.rec_radiko_ts_sh
+    else:
+        rec_radiko_ts_sh = script_dir / config.rec_radiko_ts_sh
+    return Radiko(rec_radiko_ts_sh, config.radiko_email, config.radiko_pw, script_dir, config.storage_dir,
+                  fetch_workers=config.fetch_workers, http_timeout=config.http_timeout,
+                  schedule_cache=ScheduleCache(script_dir / 'cache' / 'schedule', config.schedule_cache_ttl),
+                  rate_limiter=RateLimiter(config.radiko_request_interval),
+                  part_workers=config.record_part_workers,
+                  file_mover=FileMover(config.storage_fsync, config.storage_checksum),
+                  artwork_cache=ArtworkCache(script_dir / 'cache' / 'artwork', config.artwork_cache_max_mb * 1024 * 1024,
+                                             timeout=config.http_timeout),
+                  plan_cache=PlanCache(script_dir / 'cache' / 'plan') if config.incremental_plan else None,
+                  segment_minutes=config.segment_minutes, segment_workers=config.segment_workers,
+                  record_backend=config.record_backend, download_workers=config.download_workers,
+                  auth_cache=script_dir / 'cache' / 'radiko_auth.json', direct_storage=config.storage_direct,
+                  plan_snapshot=PlanSnapshot(script_dir / 'cache' / 'snapshot', config.plan_snapshot_ttl))
+
+
+def create_latest() -> Latest:
+    last_record_at_filename = script_dir / 'last_record_at.yaml'
+    if config.state_backend == 'sqlite':
+        return Latest(script_dir / 'last_record_at.sqlite3', import_from=last_record_at_filename)
+    return Latest(last_record_at_filename)
+
+
+def record_programs(radiko: Radiko, programs: dict, latest: Latest, email: 'MailDispatcher', errors: list[str]) -> None:
+    """録音対象の番組を並列に録音し、1番組ごとに記録・通知する"""
+    jobs = list(programs.items())
+    for title, _ in jobs:
+        logger.debug(f'program: {title}')
+    radiko.prefetch_artwork([program for _, program in jobs])
+    executor = RecordingExecutor(radiko.record, config.record_workers, config.record_workers_per_station,
+                                 stop=radiko.abort_event)
+    for result in executor.run(jobs):
+        if result.error:
+            logger.error(f'failed to record {result.key}: {result.error}')
+            errors.append(str(result.error))
+            continue
+        program = result.recorded
+        if program.filepath:
+            latest.set(program)
+            latest.save()
+            msg = f'録音完了:{program.title_key}'
+            dt = program.start_time[:4] + '-' + program.start_time[4:6] + '-' + program.start_time[6:8]
+            body = f'日付: {dt}'
+            if program.artist:
+                body += f'<br>出演者: {program.artist}'
+            email.send(msg, body)
+
+
+def recordable_programs(programs: dict, latest: Latest, n: datetime, since: str | None = None) -> dict:
+    now = n.strftime('%Y%m%d%H%M%S')
+    record_start = (n - timedelta(minutes=5)).strftime('%Y%m%d%H%M%S')
+    ret = {}
+    for title, program in programs.items():
+        if not can_record(now, record_start, program, latest):
+            continue
+        if since:
+            pgs = program[0] if isinstance(program, list) else program
+            if pgs.start_time < since:
+                continue
+        ret[title] = program
+    return ret
+
+
+def next_recordable_at(programs: dict, latest: Latest, n: datetime) -> datetime | None:
+    """未録音の番組のうち、次にタイムフリーで録音可能になる時刻（終了5分後）"""
+    ret = None
+    for program in programs.values():
+        pgs, pge = _program_start_end(program)
+        if pgs.start_time <= latest.get(pgs):
+            continue
+        at = epoch_to_datetime(pge.end_at) + timedelta(minutes=5)
+        if at > n and (ret is None or at < ret):
+            ret = at
+    return ret
+
+
+def write_metrics() -> None:
+    # node_exporter の textfile collector 用。失敗しても録音処理には影響させない
+    if not config.metrics_textfile:
+        return
+    try:
+        metrics.write_prometheus(Path(config.metrics_textfile))
+    except OSError as e:
+        logger.warning(f'failed to write metrics to {config.metrics_textfile}: {e}')
+
+
+def run_daemon(radiko: Radiko, latest: Latest, email: 'MailDispatcher', stop: threading.Event,
+               full_replan: bool = False) -> None:
+    """番組表を保持したまま常駐し、各番組が録音可能になった時刻に録音する"""
+    radio_yml = script_dir / 'radio.yaml'
+    refresh_seconds = config.daemon_refresh_minutes * 60
+    programs: dict = {}
+    radio_mtime = None
+    next_refresh = 0.0
+    retry_at: dict[str, float] = {}
+    cleaned = False
+
+    while not stop.is_set():
+        errors: list[str] = []
+        n = datetime.now()
+        try:
+            mtime = radio_yml.stat().st_mtime
+            if time.monotonic() >= next_refresh or mtime != radio_mtime:
+                programs = radiko.get_programs(load_radio(), plan_window(n, False, 0, None), full_replan)
+                full_replan = False
+                radio_mtime = mtime
+                next_refresh = time.monotonic() + refresh_seconds
+                if not cleaned:
+                    # 書きかけのファイルは起動時に1度だけ、計画した番組の保存先から消す
+                    radiko.cleanup_partials(programs)
+                    cleaned = True
+
+            # 失敗した番組はしばらく間をおいてから再試行する
+            due = {key: program for key, program in recordable_programs(programs, latest, n).items()
+                   if retry_at.get(key, 0.0) <= time.monotonic()}
+            if due:
+                record_programs(radiko, due, latest, email, errors)
+                for key, program in due.items():
+                    pgs, _ = _program_start_end(program)
+                    if pgs.start_time > latest.get(pgs):
+                        retry_at[key] = time.monotonic() + DAEMON_RETRY_SECONDS
+        except Exception as e:
+            logger.exception(e)
+            errors.append(str(e))
+            next_refresh = min(next_refresh, time.monotonic() + DAEMON_RETRY_SECONDS)
+        if errors and not stop.is_set():
+            email.send('録音エラー', '<br>'.join(errors))
+        write_metrics()
+
+        n = datetime.now()
+        wait_seconds = next_refresh - time.monotonic()
+        at = next_recordable_at(programs, latest, n)
+        if at:
+            wait_seconds = min(wait_seconds, (at - n).total_seconds())
+        if retry_at:
+            wait_seconds = min(wait_seconds, min(retry_at.values()) - time.monotonic())
+        wait_seconds = max(1.0, wait_seconds)
+        logger.info(f'sleeping {wait_seconds:.0f}s')
+        stop.wait(wait_seconds)
+        retry_at = {key: at for key, at in retry_at.items() if at > time.monotonic()}
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--list-upcoming', action='store_true', help='録音予定の番組一覧を表示して終了する')
     parser.add_argument('--list-days', type=int, default=7, help='録音予定の表示対象日数 (既定: 7)')
     parser.add_argument('--since-hours', type=int, default=None, help='N時間以内に開始した番組のみ録音対象にする')
+    parser.add_argument('--status', action='store_true', help='録音待ち・録音予定の番組を表示して終了する')
+    parser.add_argument('--daemon', action='store_true', help='常駐して番組が録音可能になった時刻に録音する')
+    parser.add_argument('--full-replan', action='store_true', help='前回の抽出結果を使わず、全番組を判定し直す')
     args = parser.parse_args()
 
+    global config
+    setup_logging()
+    warnings.filterwarnings("ignore", category=SyntaxWarning, module='pydub.utils')
+    config = load_config()
+
     n = datetime.now()
     now = n.strftime('%Y%m%d%H%M%S')
-    record_start = (n - timedelta(minutes=5)).strftime('%Y%m%d%H%M%S')
     since = (n - timedelta(hours=args.since_hours)).strftime('%Y%m%d%H%M%S') if args.since_hours else None
     logger.info(f'now: {now}')
 
-    email = Email(config.gmail_sender, config.gmail_pw, config.gmail_receiver)
+    email = None
     errors: list[str] = []
 
     try:
-        last_record_at_filename = script_dir / 'last_record_at.yaml'
-        latest = Latest(last_record_at_filename)
-        if len(config.rec_radiko_ts_sh.parts) > 1:
-            rec_radiko_ts_sh = config.rec_radiko_ts_sh
-        else:
-            rec_radiko_ts_sh = script_dir / config.rec_radiko_ts_sh
-        radiko = Radiko(rec_radiko_ts_sh, config.radiko_email, config.radiko_pw, script_dir, config.storage_dir)
-        programs = radiko.get_programs(load_radio())
-
-        if args.list_upcoming:
-            show_upcoming(programs, latest, n, args.list_days)
+        latest = create_latest()
+        radiko = create_radiko()
+
+        if args.daemon:
+            # 常駐中は番組名の系列が増え続けるため、集計は局ごとにとどめる（番組ごとの値は metrics.jsonl に残る）
+            metrics.series_labels = ('station',)
+            email = create_email()
+            stop = threading.Event()
+
+            def shutdown(signum, frame):
+                logger.info(f'received signal {signum}, shutting down ...')
+                stop.set()
+                radiko.abort()
+
+            signal.signal(signal.SIGTERM, shutdown)
+            signal.signal(signal.SIGINT, shutdown)
+            run_daemon(radiko, latest, email, stop, args.full_replan)
             return
 
-        for title, program in programs.items():
-            if not can_record(now, record_start, program, latest):
-                continue
-            if since:
-                pgs = program[0] if isinstance(program, list) else program
-                if pgs.start_time < since:
-                    continue
-
-            logger.debug(f'program: {title}')
-            try:
-                program = radiko.record(program)
-            except Exception as e:
-                logger.error(f'failed to record {title}: {e}')
-                errors.append(str(e))
-                continue
-            if program.filepath:
-                latest.set(program)
-                latest.save()
-                msg = f'録音完了:{program.title_key}'
-                dt = program.start_time[:4] + '-' + program.start_time[4:6] + '-' + program.start_time[6:8]
-                body = f'日付: {dt}'
-                if program.artist:
-                    body += f'<br>出演者: {program.artist}'
-                email.send(msg, body)
+        window = status_window(n) if args.status else plan_window(n, args.list_upcoming, args.list_days, since)
+        if args.list_upcoming or args.status:
+            programs = plan_programs(radiko, window, args.full_replan)
+            if args.list_upcoming:
+                show_upcoming(programs, latest, n, args.list_days)
+            else:
+                show_status(programs, latest, n)
+            return
+
+        programs = radiko.get_programs(load_radio(), window, args.full_replan)
+        radiko.cleanup_partials(programs)
+
+        email = create_email()
+        record_programs(radiko, recordable_programs(programs, latest, n, since), latest, email, errors)
     except Exception as e:
         logger.exception(e)
         errors.append(str(e))
     finally:
         if errors:
             body = '<br>'.join(errors)
+            email = email or create_email()
             email.send('録音エラー', body)
+        if email:
+            email.close()
+        write_metrics()
         logger.info('done')
 
 
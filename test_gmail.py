@@ -0,0 +1,160 @@
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+from email import message_from_string
+from email.header import decode_header, make_header
+from pathlib import Path
+from gmail import MailDispatcher
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str) -> None:
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 fake ESMTP')
+        while True:
+            line = self.rfile.readline().decode().rstrip('\r\n')
+            if not line:
+                return
+            command = line.split(' ', 1)[0].upper()
+            if command == 'EHLO':
+                self.reply('250-fake')
+                self.reply('250 AUTH PLAIN')
+            elif command == 'AUTH':
+                self.reply('235 ok')
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                while (line := self.rfile.readline().decode()) != '.\r\n':
+                    data.append(line)
+                with server.lock:
+                    server.messages.append(message_from_string(''.join(data)))
+                self.reply('250 queued')
+            elif command == 'QUIT':
+                server.quitting.set()
+                time.sleep(server.quit_delay)
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0):
+        super().__init__(('127.0.0.1', port), FakeSMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        self.quit_delay = 0.0
+        self.quitting = threading.Event()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def subject(message) -> str:
+    return str(make_header(decode_header(message['Subject'])))
+
+
+def wait_until(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class TestMailDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.spool = Path(self.tmp.name) / 'spool'
+
+    def make_dispatcher(self, port: int, **kwargs) -> MailDispatcher:
+        dispatcher = MailDispatcher('from@example.com', 'pw', 'to@example.com', self.spool,
+                                    host='127.0.0.1', port=port, starttls=False, **kwargs)
+        self.addCleanup(dispatcher.close, 5)
+        return dispatcher
+
+    def test_batches_into_digest(self):
+        server = FakeSMTPServer()
+        self.addCleanup(server.stop)
+        dispatcher = self.make_dispatcher(server.server_address[1], digest_seconds=0.3)
+        for i in range(3):
+            self.assertTrue(dispatcher.send(f'録音完了:番組{i}', f'日付: 2026-03-2{i}'))
+        self.assertTrue(wait_until(lambda: server.messages))
+        dispatcher.close()
+        self.assertEqual(len(server.messages), 1)
+        self.assertEqual(subject(server.messages[0]), '録音完了:番組0 ほか (3件)')
+        self.assertEqual(list(self.spool.iterdir()), [])
+
+    def test_reuses_connection(self):
+        server = FakeSMTPServer()
+        self.addCleanup(server.stop)
+        dispatcher = self.make_dispatcher(server.server_address[1], digest_seconds=0)
+        dispatcher.send('a', 'a')
+        self.assertTrue(wait_until(lambda: len(server.messages) == 1))
+        dispatcher.send('b', 'b')
+        self.assertTrue(wait_until(lambda: len(server.messages) == 2))
+        self.assertEqual(server.connections, 1)
+
+    def test_slow_idle_disconnect_does_not_block_send(self):
+        server = FakeSMTPServer()
+        self.addCleanup(server.stop)
+        server.quit_delay = 1.0
+        dispatcher = self.make_dispatcher(server.server_address[1], digest_seconds=0, idle_seconds=0.1)
+        dispatcher.send('a', 'a')
+        self.assertTrue(server.quitting.wait(5))
+        started = time.monotonic()
+        self.assertTrue(dispatcher.send('b', 'b'))
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertTrue(wait_until(lambda: len(server.messages) == 2))
+
+    def test_unsent_mail_survives_restart(self):
+        port = free_port()
+        dispatcher = self.make_dispatcher(port, digest_seconds=0, retry_seconds=0.05)
+        dispatcher.send('録音エラー', 'error')
+        time.sleep(0.2)
+        dispatcher.close()
+        self.assertEqual(len(list(self.spool.glob('*.json'))), 1)
+
+        server = FakeSMTPServer(port)
+        self.addCleanup(server.stop)
+        dispatcher = self.make_dispatcher(port, digest_seconds=0)
+        self.assertTrue(wait_until(lambda: server.messages))
+        dispatcher.close()
+        self.assertEqual(subject(server.messages[0]), '録音エラー')
+        self.assertEqual(list(self.spool.glob('*.json')), [])
+
+    def test_disabled_without_addresses(self):
+        dispatcher = MailDispatcher('', '', '', self.spool)
+        self.assertFalse(dispatcher.send('a', 'b'))
+        self.assertFalse(self.spool.exists())
+
+    def test_disabled_without_password(self):
+        dispatcher = MailDispatcher('from@example.com', '', 'to@example.com', self.spool)
+        self.assertFalse(dispatcher.send('a', 'b'))
+        self.assertFalse(self.spool.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
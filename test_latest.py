@@ -0,0 +1,69 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from latest import Latest
+from test_radiko import make_program
+
+
+class TestSqliteLatest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+
+    def test_imports_yaml_once(self):
+        yaml_path = self.dir / 'last_record_at.yaml'
+        yaml_path.write_text("ＡＢＣ番組: '20260321100000'\n", encoding='utf-8')
+        latest = Latest(self.dir / 'last_record_at.sqlite3', import_from=yaml_path)
+        self.assertEqual(latest.get(make_program(series_key='ABC番組')), '20260321100000')
+
+        yaml_path.write_text("ABC番組: '20260328100000'\n", encoding='utf-8')
+        latest = Latest(self.dir / 'last_record_at.sqlite3', import_from=yaml_path)
+        self.assertEqual(latest.get(make_program(series_key='ABC番組')), '20260321100000')
+
+    def test_keeps_episode_history_and_latest_start(self):
+        path = self.dir / 'last_record_at.sqlite3'
+        latest = Latest(path)
+        latest.set(make_program(start_time='20260328100000', filepath='/a.m4a', filehash='aa'))
+        latest.set(make_program(start_time='20260321100000', filepath='/b.m4a', filehash='bb'))
+
+        reopened = Latest(path)
+        self.assertEqual(reopened.get(make_program()), '20260328100000')
+        history = reopened.history(make_program())
+        self.assertEqual([h['start_time'] for h in history], ['20260321100000', '20260328100000'])
+        self.assertEqual(history[1]['filehash'], 'aa')
+        self.assertEqual(history[1]['station'], 'LFR')
+
+    def test_concurrent_writers(self):
+        path = self.dir / 'last_record_at.sqlite3'
+        Latest(path)
+
+        def writer(offset):
+            latest = Latest(path)
+            for day in range(10):
+                latest.set(make_program(series_key=f'番組{offset}', start_time=f'202603{day + 10}100000'))
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latest = Latest(path)
+        for i in range(4):
+            self.assertEqual(len(latest.history(make_program(series_key=f'番組{i}'))), 10)
+
+
+class TestYamlLatest(unittest.TestCase):
+    def test_set_only_moves_forward(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'last_record_at.yaml'
+            latest = Latest(path)
+            latest.set(make_program(start_time='20260328100000'))
+            latest.set(make_program(start_time='20260321100000'))
+            latest.save()
+            self.assertEqual(Latest(path).get(make_program()), '20260328100000')
+
+
+if __name__ == '__main__':
+    unittest.main()
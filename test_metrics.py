@@ -0,0 +1,61 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_phase_records_duration_bytes_and_status(self):
+        m = Metrics()
+        with m.phase('move', station='LFR', program='番組') as extra:
+            extra['bytes'] = 100
+        with self.assertRaises(ValueError):
+            with m.phase('move', station='LFR', program='番組'):
+                raise ValueError
+        with m.phase('rec_radiko_ts', station='LFR') as extra:
+            extra['status'] = 'error'
+
+        phases, sizes = m.snapshot()
+        move = phases[('move', (('program', '番組'), ('station', 'LFR')))]
+        self.assertEqual((move['count'], move['errors']), (2, 1))
+        self.assertEqual(sizes[('move', (('program', '番組'), ('station', 'LFR')))], 100)
+        self.assertEqual(phases[('rec_radiko_ts', (('station', 'LFR'),))]['errors'], 1)
+
+    def test_json_log_line(self):
+        m = Metrics()
+        with self.assertLogs('metrics', level='INFO') as logs:
+            with m.phase('fetch', station='TBS') as extra:
+                extra['bytes'] = 10
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['phase'], record['station'], record['bytes'], record['status']),
+                         ('fetch', 'TBS', 10, 'ok'))
+
+    def test_write_prometheus(self):
+        m = Metrics()
+        m.observe('move', 1.5, program='a"b', bytes=2048)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'textfile' / 'rec_radiko_pg.prom'
+            m.write_prometheus(path)
+            text = path.read_text(encoding='utf-8')
+            self.assertEqual(list(path.parent.iterdir()), [path])
+        self.assertIn('rec_radiko_pg_phase_seconds_sum{phase="move",program="a\\"b"} 1.500000', text)
+        self.assertIn('rec_radiko_pg_phase_seconds_count{phase="move",program="a\\"b"} 1', text)
+        self.assertIn('rec_radiko_pg_phase_bytes_total{phase="move",program="a\\"b"} 2048', text)
+        self.assertIn('# TYPE rec_radiko_pg_phase_bytes_total counter', text)
+        self.assertIn('# TYPE rec_radiko_pg_phase_errors_total counter', text)
+
+    def test_series_labels_bound_cardinality(self):
+        m = Metrics(series_labels=('station',))
+        with self.assertLogs('metrics', level='INFO') as logs:
+            for i in range(100):
+                m.observe('rec_radiko_ts', 1.0, station='LFR', program=f'番組{i}', bytes=10)
+        phases, sizes = m.snapshot()
+        self.assertEqual(list(phases), [('rec_radiko_ts', (('station', 'LFR'),))])
+        self.assertEqual(phases[('rec_radiko_ts', (('station', 'LFR'),))]['count'], 100)
+        self.assertEqual(sizes[('rec_radiko_ts', (('station', 'LFR'),))], 1000)
+        self.assertEqual(json.loads(logs.records[-1].getMessage())['program'], '番組99')
+
+
+if __name__ == '__main__':
+    unittest.main()
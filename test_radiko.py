@@ -1,7 +1,23 @@
+import re
+import tempfile
+import time
 import unittest
 from pathlib import Path
-from unittest.mock import patch
-from radiko import Radiko, Program
+from unittest.mock import MagicMock, patch
+import requests
+import errno
+import hashlib
+import http.server
+import os
+import random
+import threading
+from datetime import datetime
+import xml.etree.ElementTree as ET
+from radiko._fs import write_atomic
+from radiko.audio_concatenator import AudioConcatenator
+from radiko import (ArtworkCache, DownloadError, FileMover, HlsDownloader, MoveResult, PlanCache, PlanSnapshot,
+                    Radiko, RadikoAuth, Program, RateLimiter, RecordingExecutor, ScheduleCache, ScheduleTable,
+                    TextMatcher, WEEKDAYS, normalize_text)
 
 
 def make_radiko() -> Radiko:
@@ -24,6 +40,15 @@ def make_program(**kwargs) -> Program:
     return Program(**defaults)
 
 
+def make_weekly_xml(station: str, progs: list[tuple[str, str, str, str]]) -> str:
+    items = ''.join(
+        f'<prog ft="{ft}" to="{to}"><title>{title}</title><pfm>{pfm}</pfm><img></img></prog>'
+        for ft, to, title, pfm in progs
+    )
+    return (f'<?xml version="1.0" encoding="UTF-8"?><radiko><stations>'
+            f'<station id="{station}"><progs>{items}</progs></station></stations></radiko>')
+
+
 WORDS_CF = {
     'words_by_mode': {'contains': ['テスト']},
     'stations': ['LFR'],
@@ -42,13 +67,16 @@ TITLE_CF = {
 }
 
 
-class TestRecordingByWords(unittest.TestCase):
+class TestMatchRulesByWords(unittest.TestCase):
     def setUp(self):
         self.r = make_radiko()
 
+    def _match(self, pg: Program, cf: dict) -> Program | None:
+        return self.r._match_rules(pg, *self.r._rule_index([cf]))
+
     def test_returns_copy_not_original(self):
         pg = make_program()
-        result = self.r._recording_by_words(pg, WORDS_CF)
+        result = self._match(pg, WORDS_CF)
         self.assertIsNotNone(result)
         self.assertIsNot(result, pg)
 
@@ -56,73 +84,82 @@ class TestRecordingByWords(unittest.TestCase):
         pg = make_program()
         original_artist = pg.artist
         original_found_by = pg.found_by
-        self.r._recording_by_words(pg, WORDS_CF)
+        self._match(pg, WORDS_CF)
         self.assertEqual(pg.artist, original_artist)
         self.assertEqual(pg.found_by, original_found_by)
 
     def test_found_by_words(self):
         pg = make_program()
-        result = self.r._recording_by_words(pg, WORDS_CF)
+        result = self._match(pg, WORDS_CF)
         self.assertEqual(result.found_by, 'words')
 
     def test_filename_format(self):
         pg = make_program()
-        result = self.r._recording_by_words(pg, WORDS_CF)
+        result = self._match(pg, WORDS_CF)
         self.assertEqual(result.filename, 'テスト番組_20260328.m4a')
 
     def test_no_match_returns_none(self):
         pg = make_program(radiko_title='全然違う番組', pfm='')
-        result = self.r._recording_by_words(pg, WORDS_CF)
+        result = self._match(pg, WORDS_CF)
         self.assertIsNone(result)
 
     def test_pfm_match(self):
         pg = make_program(radiko_title='全然違う番組', pfm='テスト太郎')
-        result = self.r._recording_by_words(pg, WORDS_CF)
+        result = self._match(pg, WORDS_CF)
         self.assertIsNotNone(result)
         self.assertEqual(result.found_by, 'words')
 
 
-class TestRecordingByTitle(unittest.TestCase):
+class TestMatchRulesByTitle(unittest.TestCase):
     def setUp(self):
         self.r = make_radiko()
 
+    def _match(self, pg: Program, cf: dict) -> Program | None:
+        return self.r._match_rules(pg, *self.r._rule_index([cf]))
+
+    def test_weekday_mismatch_returns_none(self):
+        pg = make_program()
+        weekday = WEEKDAYS[(pg.start_datetime.weekday() + 1) % 7]
+        self.assertIsNone(self._match(pg, dict(TITLE_CF, radiko_dayw=weekday)))
+        self.assertIsNotNone(self._match(pg, dict(TITLE_CF, radiko_dayw=WEEKDAYS[pg.start_datetime.weekday()])))
+
     def test_returns_copy_not_original(self):
         pg = make_program()
-        result = self.r._recording_by_title(pg, TITLE_CF)
+        result = self._match(pg, TITLE_CF)
         self.assertIsNotNone(result)
         self.assertIsNot(result, pg)
 
     def test_does_not_mutate_original(self):
         pg = make_program()
         original_album = pg.album
-        self.r._recording_by_title(pg, TITLE_CF)
+        self._match(pg, TITLE_CF)
         self.assertEqual(pg.album, original_album)
 
     def test_found_by_title(self):
         pg = make_program()
-        result = self.r._recording_by_title(pg, TITLE_CF)
+        result = self._match(pg, TITLE_CF)
         self.assertEqual(result.found_by, 'title')
 
     def test_album_tag_expanded_in_storage_dir(self):
         pg = make_program()
-        result = self.r._recording_by_title(pg, TITLE_CF)
+        result = self._match(pg, TITLE_CF)
         # storage_dir: '{album}/%Y' → 'テストアルバム/2026'
         self.assertEqual(result.storage_dir, 'テストアルバム/2026')
 
     def test_artist_tag_expanded_in_storage_dir(self):
         cf = dict(TITLE_CF, storage_dir='{artist}/%Y')
         pg = make_program()
-        result = self.r._recording_by_title(pg, cf)
+        result = self._match(pg, cf)
         self.assertEqual(result.storage_dir, 'テスト出演者/2026')
 
     def test_station_mismatch_returns_none(self):
         pg = make_program(station='TBS')
-        result = self.r._recording_by_title(pg, TITLE_CF)
+        result = self._match(pg, TITLE_CF)
         self.assertIsNone(result)
 
     def test_title_mismatch_returns_none(self):
         pg = make_program(radiko_title='全然違う番組')
-        result = self.r._recording_by_title(pg, TITLE_CF)
+        result = self._match(pg, TITLE_CF)
         self.assertIsNone(result)
 
 
@@ -165,6 +202,37 @@ class TestFilterPrograms(unittest.TestCase):
         result = self.r._filter_programs([pg], [WORDS_CF, TITLE_CF])
         self.assertEqual(len(result), 0)
 
+    def test_first_title_rule_for_station_and_weekday_wins(self):
+        other_station = {**TITLE_CF, 'station': 'TBS', 'album': '別局'}
+        other_day = {**TITLE_CF, 'radiko_dayw': '日曜日', 'album': '日曜'}
+        saturday = {**TITLE_CF, 'radiko_dayw': '土曜日', 'album': '土曜'}
+        radio = [WORDS_CF, other_station, other_day, saturday, TITLE_CF]
+        with patch.object(Radiko, '_title_matcher', autospec=True, side_effect=Radiko._title_matcher) as matcher:
+            result = self.r._filter_programs([make_program()], radio)
+        self.assertEqual(list(result.values())[0].album, '土曜')
+        self.assertEqual([call.args[1] for call in matcher.call_args_list], [saturday])
+
+
+class TestKeyStripRegex(unittest.TestCase):
+    def setUp(self):
+        self.r = make_radiko()
+
+    def test_invalid_pattern_warned_once(self):
+        with self.assertLogs('radiko', level='WARNING') as logs:
+            self.r.key_strip_regex = ['(', r'第?\d+回$']
+            self.r._series_key('番組 第3回')
+            self.r._series_key('番組 第4回')
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(self.r._series_key('番組 第3回'), '番組')
+
+    def test_key_memoized_and_reset_on_change(self):
+        self.r._title_key('テスト番組 第1回')
+        self.r._title_key('テスト番組 第1回')
+        self.assertEqual(self.r.key_cache_info()['title_key'].hits, 1)
+        self.r.key_strip_regex = []
+        self.assertEqual(self.r.key_cache_info()['title_key'].currsize, 0)
+        self.assertEqual(self.r._title_key('テスト番組 第1回'), 'テスト番組 第1回')
+
 
 class TestDedupeKey(unittest.TestCase):
     def setUp(self):
@@ -258,5 +326,936 @@ class TestGetProgramsDedup(unittest.TestCase):
         self.assertEqual(list(programs.values())[0].found_by, 'title')
 
 
+class TestParseProgramsXml(unittest.TestCase):
+    XML = make_weekly_xml('LFR', [
+        ('20260327230000', '20260328010000', '前日の番組', ''),
+        ('20260328100000', '20260328110000', 'テスト番組　第3回', 'テスト　出演者'),
+        ('20260329100000', '20260329110000', '翌日の番組', ''),
+        ('20260328120000', '20260328130000', '', ''),
+    ])
+
+    def setUp(self):
+        self.r = make_radiko()
+
+    def test_parse_all(self):
+        progs = self.r._parse_programs_xml(self.XML, {})
+        self.assertEqual([pg.start_time for pg in progs], ['20260327230000', '20260328100000', '20260329100000'])
+        pg = progs[1]
+        self.assertEqual(pg.station, 'LFR')
+        self.assertEqual(pg.pfm, 'テスト 出演者')
+        self.assertEqual(pg.duration, 3600)
+        self.assertEqual(pg.series_key, 'テスト番組')
+
+    def test_times_parsed_once(self):
+        progs = self.r._parse_programs_xml(self.XML, {})
+        self.assertEqual(progs[0].duration, 2 * 3600)
+        self.assertEqual(progs[1].start_datetime, datetime(2026, 3, 28, 10, 0))
+        self.assertEqual(progs[1].end_at - progs[0].end_at, 10 * 3600)
+        self.assertIs(progs[0].station, progs[1].station)
+        self.assertFalse(hasattr(progs[0], '__dict__'))
+
+    def test_post_init_fills_times(self):
+        pg = make_program(start_time='20260328100000', end_time='20260328120000')
+        self.assertEqual(pg.end_at - pg.start_at, 7200)
+        [matched] = self.r._filter_programs([pg], [TITLE_CF]).values()
+        self.assertEqual(matched.start_at, pg.start_at)
+
+    def test_window_prunes_by_start_time(self):
+        progs = self.r._parse_programs_xml(self.XML, {}, ('20260328000000', '20260329000000'))
+        self.assertEqual([pg.radiko_title for pg in progs], ['テスト番組　第3回'])
+
+    def test_replace_config(self):
+        progs = self.r._parse_programs_xml(self.XML, {'テスト番組': '置換番組'}, ('20260328000000', '20260329000000'))
+        self.assertEqual(progs[0].radiko_title, '置換番組　第3回')
+
+    def test_parse_from_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'LFR.xml'
+            path.write_text(self.XML, encoding='utf-8')
+            self.assertEqual(self.r._parse_programs_xml(path, {}), self.r._parse_programs_xml(self.XML, {}))
+
+    def test_processed_progs_detached(self):
+        roots = []
+        iterparse = ET.iterparse
+
+        def recording_iterparse(*args, **kwargs):
+            for event, elem in iterparse(*args, **kwargs):
+                if not roots:
+                    roots.append(elem)
+                yield event, elem
+
+        with patch('radiko.ET.iterparse', recording_iterparse):
+            self.assertEqual(len(self.r._parse_programs_xml(self.XML, {})), 3)
+        # 解析済みの番組は木から外れ、1週間分の要素が残らない
+        self.assertEqual([elem.tag for elem in roots[0].iter() if elem.tag in ('prog', 'progs')], [])
+
+
+class TestGetProgramsConcurrentFetch(unittest.TestCase):
+    XMLS = {
+        'LFR': make_weekly_xml('LFR', [('20260328100000', '20260328110000', 'テスト番組', '')]),
+        'TBS': make_weekly_xml('TBS', [('20260328150000', '20260328160000', 'テスト番組', '')]),
+        'QRR': make_weekly_xml('QRR', [('20260328200000', '20260328210000', '別のテスト', '')]),
+    }
+    RADIO = [{'words_by_mode': {'contains': ['テスト']}, 'stations': ['LFR', 'TBS', 'QRR']}]
+
+    def _get_programs(self, delays: dict) -> dict:
+        r = Radiko(Path('rec.sh'), '', '', Path('/tmp'), Path('/tmp/storage'), fetch_workers=3)
+
+        def fake_xml(station):
+            time.sleep(delays[station])
+            return self.XMLS[station]
+
+        with patch.object(r, '_get_programs_xml', side_effect=fake_xml):
+            return r.get_programs(self.RADIO)
+
+    def test_result_independent_of_completion_order(self):
+        fast_lfr = self._get_programs({'LFR': 0, 'TBS': 0.05, 'QRR': 0.1})
+        fast_qrr = self._get_programs({'LFR': 0.1, 'TBS': 0.05, 'QRR': 0})
+        self.assertEqual(list(fast_lfr.keys()), list(fast_qrr.keys()))
+        self.assertEqual(
+            [pg.station for pg in fast_lfr.values()],
+            [pg.station for pg in fast_qrr.values()],
+        )
+
+
+class TestIncrementalReplan(unittest.TestCase):
+    PROGS = [
+        ('20260327100000', '20260327110000', 'テスト番組', ''),
+        ('20260328100000', '20260328110000', 'テスト番組', ''),
+        ('20260328110000', '20260328120000', 'テスト番組', ''),
+        ('20260328130000', '20260328140000', '関係ない番組', ''),
+    ]
+    RADIO = [{'words_by_mode': {'contains': ['テスト']}, 'stations': ['LFR']}, TITLE_CF]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.plan_cache = PlanCache(Path(self.tmp.name))
+
+    def _get_programs(self, progs: list, radio: list, plan_cache: PlanCache | None, full_replan: bool = False,
+                      window: tuple[str, str] | None = None):
+        r = Radiko(Path('rec.sh'), '', '', Path('/tmp'), Path('/tmp/storage'), plan_cache=plan_cache)
+        with patch.object(r, '_get_programs_xml', return_value=make_weekly_xml('LFR', progs)), \
+                patch.object(r, '_match_rules', wraps=r._match_rules) as match_rules:
+            return r.get_programs(radio, window, full_replan), match_rules.call_count
+
+    def test_only_changed_entries_reevaluated(self):
+        _, evaluated = self._get_programs(self.PROGS, self.RADIO, self.plan_cache)
+        self.assertEqual(evaluated, 4)
+
+        # 延長で後ろの枠がずれた
+        shifted = self.PROGS[:2] + [('20260328113000', '20260328123000', 'テスト番組', '')] + self.PROGS[3:]
+        programs, evaluated = self._get_programs(shifted, self.RADIO, self.plan_cache)
+        self.assertEqual(evaluated, 1)
+        full, _ = self._get_programs(shifted, self.RADIO, None)
+        self.assertEqual(programs, full)
+
+    def test_radio_change_and_full_replan_reevaluate_all(self):
+        self._get_programs(self.PROGS, self.RADIO, self.plan_cache)
+        _, evaluated = self._get_programs(self.PROGS, self.RADIO, self.plan_cache, full_replan=True)
+        self.assertEqual(evaluated, 4)
+        radio = [self.RADIO[0], {**TITLE_CF, 'album': '変更'}]
+        programs, evaluated = self._get_programs(self.PROGS, radio, self.plan_cache)
+        self.assertEqual(evaluated, 4)
+        self.assertEqual(programs, self._get_programs(self.PROGS, radio, None)[0])
+
+    def test_entries_outside_window_kept(self):
+        # 録音(過去の期間)と --list-upcoming(先の期間)を交互に実行しても、互いの結果を消さない
+        past, upcoming = ('20260327000000', '20260328000000'), ('20260328000000', '20260329000000')
+        self.plan_cache.RETENTION_DAYS = 100000
+        self.assertEqual(self._get_programs(self.PROGS, self.RADIO, self.plan_cache, window=past)[1], 1)
+        self.assertEqual(self._get_programs(self.PROGS, self.RADIO, self.plan_cache, window=upcoming)[1], 3)
+        self.assertEqual(self._get_programs(self.PROGS, self.RADIO, self.plan_cache, window=past)[1], 0)
+        self.assertEqual(self._get_programs(self.PROGS, self.RADIO, self.plan_cache, window=upcoming)[1], 0)
+
+        # 保持期間を過ぎた期間外の結果は消す
+        self.plan_cache.RETENTION_DAYS = 0
+        self._get_programs(self.PROGS, self.RADIO, self.plan_cache, window=upcoming)
+        self.assertEqual(len(self.plan_cache.load('LFR', PlanCache.config_hash(self.RADIO))), 3)
+
+
+class TestPlanSnapshot(unittest.TestCase):
+    PROGS = [
+        ('20260328100000', '20260328110000', 'テスト番組', ''),
+        ('20260328130000', '20260328140000', '関係ない番組', ''),
+    ]
+    RADIO = [{'words_by_mode': {'contains': ['テスト']}, 'stations': ['LFR']}, TITLE_CF]
+    WINDOW = ('20260321000000', '20260329000000')
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.schedule_cache = ScheduleCache(Path(self.tmp.name) / 'schedule')
+        self.store_schedule(self.PROGS)
+        self.r = Radiko(Path('rec.sh'), '', '', Path('/tmp'), Path('/tmp/storage'), schedule_cache=self.schedule_cache,
+                        plan_snapshot=PlanSnapshot(Path(self.tmp.name) / 'snapshot'))
+
+    def store_schedule(self, progs: list) -> None:
+        self.schedule_cache._store('LFR', make_weekly_xml('LFR', progs), {'fetched_at': time.time()})
+
+    def test_snapshot_reused_until_input_changes(self):
+        self.assertIsNone(self.r.cached_programs(self.RADIO, self.WINDOW))
+        programs = self.r.get_programs(self.RADIO, self.WINDOW)
+        self.assertEqual(len(programs), 1)
+        self.assertEqual(self.r.cached_programs(self.RADIO, self.WINDOW), programs)
+
+        # 期間・radio.yaml・番組表のいずれかが変われば使わない
+        self.assertIsNone(self.r.cached_programs(self.RADIO, ('20260322000000', '20260330000000')))
+        self.assertIsNone(self.r.cached_programs([self.RADIO[0], {**TITLE_CF, 'album': '変更'}], self.WINDOW))
+        self.store_schedule(self.PROGS)
+        self.assertEqual(self.r.cached_programs(self.RADIO, self.WINDOW), programs)
+        self.store_schedule(self.PROGS + [('20260328150000', '20260328160000', 'テスト番組2', '')])
+        self.assertIsNone(self.r.cached_programs(self.RADIO, self.WINDOW))
+
+    def test_expired_snapshot_not_used(self):
+        self.r.get_programs(self.RADIO, self.WINDOW)
+        self.r.plan_snapshot.ttl = 0
+        self.assertIsNone(self.r.cached_programs(self.RADIO, self.WINDOW))
+
+
+class TestScheduleTable(unittest.TestCase):
+    def test_match_rows_and_shared_strings(self):
+        table = ScheduleTable()
+        for day in range(7):
+            table.append('HBC', day * 86400, day * 86400 + 3600, 'オードリーのオールナイトニッポン', 'img', '')
+            table.append('HBC', day * 86400 + 3600, day * 86400 + 7200, 'ニュース', 'img', 'ＴＥＳＴ太郎')
+        matcher = TextMatcher([('オードリー', 'contains')], normalize_text)
+        pfm_matcher = TextMatcher([('test太郎', 'exact')], normalize_text)
+        self.assertEqual(table.match([matcher]), list(range(0, 14, 2)))
+        self.assertEqual(len(table.match([matcher, pfm_matcher])), 14)
+        self.assertEqual(table.row(1), ('HBC', 3600, 7200, 'ニュース', 'img', 'ＴＥＳＴ太郎'))
+        self.assertEqual(len(table._strings), 6)
+
+
+class TestScanAllStations(unittest.TestCase):
+    REGION_XML = ('<region><stations region_id="hokkaido-tohoku"><station><id>HBC</id></station></stations>'
+                  '<stations region_id="kanto"><station><id>LFR</id></station><station><id>TBS</id></station>'
+                  '</stations></region>')
+    XMLS = {
+        'LFR': make_weekly_xml('LFR', [('20260328010000', '20260328030000', 'オードリーのオールナイトニッポン', '')]),
+        'HBC': make_weekly_xml('HBC', [('20260328010000', '20260328030000', 'オードリーのオールナイトニッポン', ''),
+                                       ('20260328100000', '20260328110000', '千鳥のラジオ', '')]),
+        'TBS': make_weekly_xml('TBS', [('20260328100000', '20260328110000', 'ニュース', '')]),
+    }
+
+    def test_words_searched_on_every_station(self):
+        radio = [{'words_by_mode': {'contains': ['オードリー', '千鳥']}, 'stations': 'all'},
+                 {**TITLE_CF, 'station': 'LFR', 'radiko_title': '関係ない番組'}]
+        r = make_radiko()
+        with patch.object(r, '_get_xml', side_effect=lambda url, key: self.REGION_XML if key == 'region_full' else self.XMLS[key]):
+            programs = r.get_programs(radio)
+        # 同じネット番組は radio.yaml に書いた局を優先する
+        self.assertEqual(sorted((pg.station, pg.radiko_title, pg.start_time) for pg in programs.values()), [
+            ('HBC', '千鳥のラジオ', '20260328100000'),
+            ('LFR', 'オードリーのオールナイトニッポン', '20260328010000'),
+        ])
+        self.assertEqual(programs['20260328:千鳥'].filename, '千鳥のラジオ_20260328.m4a')
+
+    def test_scan_matches_same_programs_as_filter(self):
+        xml = make_weekly_xml('HBC', [
+            ('20260328010000', '20260328030000', 'ラジオ深夜便', 'テスト　太郎'),
+            ('20260328100000', '20260328110000', '旧番組名スペシャル', ''),
+            ('20260328120000', '20260328130000', 'ニュース', 'ＴＥＳＴ　花子'),
+            ('20260328140000', '20260328150000', '関係ない番組', '別の　出演者'),
+        ])
+        cf = {'words_by_mode': {'regex': ['テスト 太郎'], 'contains': ['新番組名', 'test花子']}, 'stations': 'all'}
+        replace_config = {'旧番組名': '新番組名'}
+        r = make_radiko()
+        scanned = r._scan_programs(xml, [cf], replace_config, None)
+        filtered = r._filter_programs(r._parse_programs_xml(xml, replace_config), [cf])
+        self.assertEqual(len(filtered), 3)
+        self.assertEqual(scanned, filtered)
+
+
+def make_response(status_code: int, text: str = '', headers: dict | None = None, content: bytes = b'') -> MagicMock:
+    response = MagicMock()
+    response.status_code = status_code
+    response.text = text
+    response.content = content
+    response.headers = headers or {}
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(str(status_code))
+    return response
+
+
+class TestScheduleCache(unittest.TestCase):
+    URL = 'http://radiko.jp/v3/program/station/weekly/LFR.xml'
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.session = MagicMock()
+
+    def test_within_ttl_no_request(self):
+        cache = ScheduleCache(Path(self.tmp.name), ttl=600)
+        self.session.get.return_value = make_response(200, '<xml/>', {'ETag': '"a"'})
+        cache.get(self.session, self.URL, 'LFR', 10)
+        self.assertEqual(cache.get(self.session, self.URL, 'LFR', 10), '<xml/>')
+        self.assertEqual(self.session.get.call_count, 1)
+
+    def test_conditional_get_not_modified(self):
+        cache = ScheduleCache(Path(self.tmp.name), ttl=0)
+        self.session.get.return_value = make_response(200, '<xml/>', {'ETag': '"a"', 'Last-Modified': 'lm'})
+        cache.get(self.session, self.URL, 'LFR', 10)
+        xml_mtime = (Path(self.tmp.name) / 'LFR.xml').stat().st_mtime_ns
+        self.session.get.return_value = make_response(304)
+        with patch('radiko.schedule_cache.write_atomic', wraps=write_atomic) as write:
+            self.assertEqual(cache.get(self.session, self.URL, 'LFR', 10), '<xml/>')
+        # 304 では XML を書き直さず、メタ情報だけ更新する
+        self.assertEqual([call.args[0].name for call in write.call_args_list], ['LFR.json'])
+        self.assertEqual((Path(self.tmp.name) / 'LFR.xml').stat().st_mtime_ns, xml_mtime)
+        headers = self.session.get.call_args.kwargs['headers']
+        self.assertEqual(headers['If-None-Match'], '"a"')
+        self.assertEqual(headers['If-Modified-Since'], 'lm')
+
+    def test_get_path_returns_cached_file(self):
+        cache = ScheduleCache(Path(self.tmp.name), ttl=600)
+        self.session.get.return_value = make_response(200, '<xml/>')
+        path = cache.get_path(self.session, self.URL, 'LFR', 10)
+        self.assertEqual(path, Path(self.tmp.name) / 'LFR.xml')
+        self.assertEqual(path.read_text(encoding='utf-8'), '<xml/>')
+
+    def test_stale_fallback_on_network_error(self):
+        cache = ScheduleCache(Path(self.tmp.name), ttl=0)
+        self.session.get.return_value = make_response(200, '<xml/>')
+        cache.get(self.session, self.URL, 'LFR', 10)
+        self.session.get.side_effect = requests.ConnectionError('down')
+        self.assertEqual(cache.get(self.session, self.URL, 'LFR', 10), '<xml/>')
+
+    def test_network_error_without_cache_raises(self):
+        cache = ScheduleCache(Path(self.tmp.name), ttl=0)
+        self.session.get.side_effect = requests.ConnectionError('down')
+        with self.assertRaises(requests.ConnectionError):
+            cache.get(self.session, self.URL, 'LFR', 10)
+
+
+class TestTextMatcher(unittest.TestCase):
+    def _brute_force(self, rules, *texts):
+        for index, (word, mode) in enumerate(rules):
+            for text in texts:
+                if mode == 'regex':
+                    if re.search(word, text, re.IGNORECASE):
+                        return index
+                    continue
+                t, w = normalize_text(text), normalize_text(word)
+                if not w:
+                    continue
+                if (mode == 'exact' and t == w) or (mode == 'contains' and w in t) or \
+                        (mode == 'prefix' and t.startswith(w)):
+                    return index
+        return None
+
+    def test_first_rule_wins_across_modes(self):
+        rules = [('番組', 'exact'), ('オールナイト', 'contains'), ('オードリー', 'prefix')]
+        matcher = TextMatcher(rules, normalize_text)
+        self.assertEqual(matcher.first_match('オードリーのオールナイトニッポン'), 1)
+        self.assertEqual(matcher.first_match('オードリーのラジオ'), 2)
+        self.assertEqual(matcher.first_match('番組'), 0)
+        self.assertIsNone(matcher.first_match('ニュース'))
+
+    def test_normalization_applied(self):
+        matcher = TextMatcher([('ＡＢＣ', 'contains')], normalize_text)
+        self.assertEqual(matcher.first_match('xx abc yy'), 0)
+
+    def test_invalid_regex_ignored(self):
+        matcher = TextMatcher([('(', 'regex'), ('^ab', 'regex')], normalize_text)
+        self.assertEqual(matcher.first_match('ABC'), 1)
+
+    def test_matches_brute_force(self):
+        rng = random.Random(0)
+        alphabet = 'abcあいう'
+        modes = ['exact', 'contains', 'prefix', 'regex']
+        for _ in range(200):
+            rules = [(''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 3))), rng.choice(modes))
+                     for _ in range(rng.randint(1, 8))]
+            texts = [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 8))) for _ in range(2)]
+            matcher = TextMatcher(rules, normalize_text)
+            self.assertEqual(matcher.first_match(*texts), self._brute_force(rules, *texts), (rules, texts))
+
+
+class TestRecordingExecutor(unittest.TestCase):
+    def test_concurrency_limits_and_per_job_results(self):
+        lock = threading.Lock()
+        active = {'total': 0, 'max_total': 0}
+        per_station: dict[str, int] = {}
+        max_per_station: dict[str, int] = {}
+
+        def record(pg):
+            with lock:
+                active['total'] += 1
+                active['max_total'] = max(active['max_total'], active['total'])
+                per_station[pg.station] = per_station.get(pg.station, 0) + 1
+                max_per_station[pg.station] = max(max_per_station.get(pg.station, 0), per_station[pg.station])
+            time.sleep(0.02)
+            with lock:
+                active['total'] -= 1
+                per_station[pg.station] -= 1
+            if pg.radiko_title == 'NG':
+                raise RuntimeError('NG')
+            return pg
+
+        jobs = [(f'k{i}', make_program(station=station, radiko_title='NG' if i == 3 else 'OK'))
+                for i, station in enumerate(['LFR', 'LFR', 'LFR', 'TBS', 'TBS', 'QRR'])]
+        executor = RecordingExecutor(record, max_workers=3, per_station=2)
+        results = {result.key: result for result in executor.run(jobs)}
+
+        self.assertEqual(set(results), {key for key, _ in jobs})
+        self.assertIsInstance(results['k3'].error, RuntimeError)
+        self.assertIsNone(results['k0'].error)
+        self.assertLessEqual(active['max_total'], 3)
+        self.assertLessEqual(max(max_per_station.values()), 2)
+
+    def test_stop_skips_queued_jobs_and_wakes_rate_limiter(self):
+        r = make_radiko()
+        r.rate_limiter = RateLimiter(min_interval=30)
+        recorded = []
+
+        def record(pg):
+            recorded.append(pg.radiko_title)
+            r.rate_limiter.wait()
+            if pg.radiko_title == 'first':
+                # 録音中に SIGTERM を受けた
+                threading.Timer(0.1, r.abort).start()
+                r.abort_event.wait(5)
+            return pg
+
+        jobs = [(f'k{i}', make_program(radiko_title='first' if i == 0 else f'queued{i}')) for i in range(5)]
+        started = time.monotonic()
+        results = list(RecordingExecutor(record, stop=r.abort_event).run(jobs))
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(recorded, ['first'])
+        self.assertEqual([result.key for result in results], ['k0'])
+
+        # 中止後の待機はすぐに戻る
+        started = time.monotonic()
+        r.rate_limiter.wait()
+        r.rate_limiter.wait()
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class TestRecordMultiPart(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.r = Radiko(Path('rec.sh'), '', '', Path(self.tmp.name), Path(self.tmp.name) / 'storage')
+        self.parts = [
+            make_program(start_time=f'202603280{h}0000', end_time=f'202603280{h + 1}0000', filename='テスト.m4a')
+            for h in range(3)
+        ]
+
+    def _fake_record_one(self, fail_index: int | None = None):
+        def record_one(pg, filepath):
+            index = self.parts.index(pg)
+            # 後ろの枠ほど早く終わるようにして完了順と枠順を変える
+            time.sleep(0.03 * (len(self.parts) - index))
+            if index == fail_index:
+                return None
+            filepath.write_text(str(index))
+            return filepath
+        return record_one
+
+    def test_parts_recorded_concurrently_and_concatenated_in_order(self):
+        concatenated = []
+
+        def concat(files, output, program, artwork):
+            concatenated.extend(f.read_text() for f in files)
+            output.write_text(''.join(concatenated))
+
+        with patch.object(self.r, '_record_one', side_effect=self._fake_record_one()), \
+             patch.object(self.r, '_concatenate_m4a', side_effect=concat), \
+             patch.object(self.r, '_get_artwork', return_value=b''), \
+             patch.object(self.r, '_set_attr'), \
+             patch.object(self.r, '_mv_file', side_effect=lambda pg, src: MoveResult(src, 0)):
+            result = self.r.record(self.parts)
+
+        self.assertEqual(concatenated, ['0', '1', '2'])
+        self.assertEqual(Path(result.filepath).read_text(), '012')
+        self.assertEqual(sorted(p.name for p in Path(self.tmp.name).iterdir()), ['テスト.m4a'])
+
+    def test_failed_part_aborts_and_cleans_up(self):
+        with patch.object(self.r, '_record_one', side_effect=self._fake_record_one(fail_index=2)), \
+             patch.object(self.r, '_concatenate_m4a') as concat, \
+             patch.object(self.r, '_get_artwork', return_value=b''):
+            with self.assertRaises(RuntimeError):
+                self.r.record(self.parts)
+        concat.assert_not_called()
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [])
+
+    def test_failed_part_stops_running_siblings(self):
+        # 最初の枠はすぐ失敗し、他の枠は録音中のまま残る
+        script = Path(self.tmp.name) / 'rec.sh'
+        script.write_text('#!/bin/sh\ncase "$2" in */20260328000000) exit 1;; esac\nexec sleep 30\n')
+        script.chmod(0o755)
+        self.r.rec_radiko_ts_sh = script
+        started = time.monotonic()
+        with patch.object(self.r, '_get_artwork', return_value=b''):
+            with self.assertRaises(RuntimeError):
+                self.r.record(self.parts)
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(self.r._procs, {})
+        self.assertEqual(sorted(p.name for p in Path(self.tmp.name).iterdir()), ['rec.sh'])
+
+
+class TestRecordSegmented(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.r = Radiko(Path('rec.sh'), '', '', Path(self.tmp.name), Path(self.tmp.name) / 'storage',
+                        segment_minutes=50)
+        self.r.SEGMENT_RETRIES = 1
+        self.r.SEGMENT_RETRY_SECONDS = 0
+        self.program = make_program(start_time='20260328010000', end_time='20260328030000', filename='テスト.m4a')
+        self.calls = []
+
+    def _fake_rec(self, failing: set):
+        def rec(program, filepath, start, end):
+            self.calls.append((start, end))
+            if start in failing:
+                return None
+            filepath.write_text(f'{start}-{end}|')
+            return filepath
+        return rec
+
+    def _concat(self, files, output):
+        output.write_text(''.join(f.read_text() for f in files))
+
+    def test_segments_cut_at_program_boundaries(self):
+        self.assertEqual(self.r._segments(self.program), [
+            ('20260328010000', '20260328015000'),
+            ('20260328015000', '20260328024000'),
+            ('20260328024000', '20260328030000'),
+        ])
+
+    def test_resumes_only_missing_segments(self):
+        with patch.object(self.r, '_rec_radiko_ts_sh', side_effect=self._fake_rec({'20260328024000'})), \
+             patch.object(self.r, '_concatenate_m4a', side_effect=self._concat) as concat:
+            self.assertIsNone(self.r._record_one(self.program))
+        concat.assert_not_called()
+        self.assertEqual(self.calls.count(('20260328024000', '20260328030000')), 2)
+        segment_dir = Path(self.tmp.name) / '.テスト.segments'
+        self.assertEqual(len(list(segment_dir.iterdir())), 2)
+
+        self.calls.clear()
+        with patch.object(self.r, '_rec_radiko_ts_sh', side_effect=self._fake_rec(set())), \
+             patch.object(self.r, '_concatenate_m4a', side_effect=self._concat):
+            filepath = self.r._record_one(self.program)
+        self.assertEqual(self.calls, [('20260328024000', '20260328030000')])
+        self.assertEqual(filepath.read_text(), '20260328010000-20260328015000|20260328015000-20260328024000|'
+                                               '20260328024000-20260328030000|')
+        self.assertFalse(segment_dir.exists())
+
+
+class FakeMP4Tags(dict):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.save = MagicMock()
+
+
+class TestSetAttr(unittest.TestCase):
+    def _set_attr(self, program: Program, tags: dict) -> FakeMP4Tags:
+        mp4 = MagicMock()
+        mp4.tags = FakeMP4Tags(tags)
+        with patch('mutagen.mp4.MP4', return_value=mp4):
+            make_radiko()._set_attr(program, Path('テスト.m4a'), b'')
+        return mp4.tags
+
+    def test_tags_written_by_concat_not_rewritten_when_artist_empty(self):
+        # 結合時の ffmpeg は空の artist を書かない
+        program = make_program(album='アルバム', title='2026-03-28', artist='')
+        tags = self._set_attr(program, {'\xa9alb': ['アルバム'], '\xa9nam': ['2026-03-28']})
+        tags.save.assert_not_called()
+        self.assertNotIn('\xa9ART', tags)
+
+    def test_mismatched_tags_rewritten(self):
+        program = make_program(album='アルバム', title='2026-03-28', artist='')
+        tags = self._set_attr(program, {'\xa9alb': ['別'], '\xa9nam': ['2026-03-28'], '\xa9ART': ['古い']})
+        tags.save.assert_called_once()
+        self.assertEqual(tags, {'\xa9alb': ['アルバム'], '\xa9nam': ['2026-03-28']})
+
+
+class TestDirectStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.work = Path(self.tmp.name) / 'work'
+        self.work.mkdir()
+        self.storage = Path(self.tmp.name) / 'storage'
+        self.r = Radiko(Path('rec.sh'), '', '', self.work, self.storage, direct_storage=True)
+        self.program = make_program(filename='テスト.m4a', storage_dir='番組')
+
+    def test_recorded_in_destination_and_published_after_tagging(self):
+        staged = []
+
+        def rec(program, filepath, start='', end=''):
+            filepath.write_bytes(b'audio')
+            return filepath
+
+        with patch.object(self.r, '_rec_radiko_ts_sh', side_effect=rec), \
+             patch.object(self.r, '_get_artwork', return_value=b''), \
+             patch.object(self.r, '_set_attr', side_effect=lambda pg, path, artwork: staged.append(path)), \
+             patch.object(self.r, '_verify'):
+            result = self.r.record(self.program)
+
+        self.assertEqual(staged, [self.storage / '番組' / '.テスト.partial.m4a'])
+        self.assertEqual(Path(result.filepath), self.storage / '番組' / 'テスト.m4a')
+        self.assertEqual(sorted(p.name for p in (self.storage / '番組').iterdir()), ['テスト.m4a'])
+        self.assertEqual(list(self.work.iterdir()), [])
+
+    def test_failed_verification_removes_partial(self):
+        def rec(program, filepath, start='', end=''):
+            filepath.write_bytes(b'')
+            return filepath
+
+        with patch.object(self.r, '_rec_radiko_ts_sh', side_effect=rec), \
+             patch.object(self.r, '_get_artwork', return_value=b''), \
+             patch.object(self.r, '_set_attr'):
+            with self.assertRaises(RuntimeError):
+                self.r.record(self.program)
+        self.assertEqual(list((self.storage / '番組').iterdir()), [])
+
+    def test_cleanup_stale_partials(self):
+        directory = self.storage / '番組'
+        directory.mkdir(parents=True)
+        old = time.time() - Radiko.TIMEFREE_RETENTION_DAYS * 24 * 60 * 60 - 60
+        recent = time.time() - Radiko.STALE_PARTIAL_SECONDS - 60
+        paths = {
+            '.古い.partial.m4a': recent,
+            '.古い.partial.0.m4a': recent,
+            '.古い.m4a.123.partial': recent,
+            '.録音中.partial.m4a': time.time(),
+            '古い.m4a': old,
+        }
+        for name, mtime in paths.items():
+            (directory / name).write_bytes(b'x')
+            os.utime(directory / name, (mtime, mtime))
+        for name, mtime in {'.期限切れ.partial.segments': old, '.再開可能.partial.segments': recent}.items():
+            (directory / name).mkdir()
+            (directory / name / 'a.m4a').write_bytes(b'x')
+            os.utime(directory / name, (mtime, mtime))
+
+        # 録音予定の番組の保存先だけを見て、他のフォルダや下位のフォルダは走査しない
+        for other in (self.storage / '他の番組', directory / '2025'):
+            other.mkdir()
+            (other / '.古い.partial.m4a').write_bytes(b'x')
+            os.utime(other / '.古い.partial.m4a', (recent, recent))
+
+        self.assertEqual(self.r.cleanup_partials(), 0)
+        self.assertEqual(self.r.cleanup_partials({'key': [self.program, self.program]}), 4)
+        self.assertEqual(sorted(p.name for p in directory.iterdir()),
+                         ['.再開可能.partial.segments', '.録音中.partial.m4a', '2025', '古い.m4a'])
+        self.assertTrue((self.storage / '他の番組' / '.古い.partial.m4a').exists())
+        self.assertTrue((directory / '2025' / '.古い.partial.m4a').exists())
+
+    def test_cleanup_expired_segments_in_tmp_dir(self):
+        # direct でなくても、一時フォルダの区間録音は再開できなくなったら消す
+        r = Radiko(Path('rec.sh'), '', '', self.work, self.storage)
+        old = time.time() - Radiko.TIMEFREE_RETENTION_DAYS * 24 * 60 * 60 - 60
+        for name in ('.期限切れ.segments', '.再開可能.segments', '期限切れ.m4a'):
+            path = self.work / name
+            if name.endswith('.segments'):
+                path.mkdir()
+            else:
+                path.write_bytes(b'x')
+            if name != '.再開可能.segments':
+                os.utime(path, (old, old))
+        self.assertEqual(r.cleanup_partials(), 1)
+        self.assertEqual(sorted(p.name for p in self.work.iterdir()), ['.再開可能.segments', '期限切れ.m4a'])
+
+
+class FakeRadikoHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body: bytes, headers: dict | None = None, status: int = 200):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split('?', 1)[0]
+        if path == '/v2/api/auth1':
+            with server.lock:
+                server.auth_count += 1
+            self._send(b'', {'X-Radiko-AuthToken': 'token', 'X-Radiko-KeyOffset': '8', 'X-Radiko-KeyLength': '16'})
+        elif path == '/v2/api/auth2':
+            server.partial_keys.append(self.headers['X-Radiko-PartialKey'])
+            self._send(b'JP13,tokyo Japan')
+        elif self.headers.get('X-Radiko-AuthToken') != 'token':
+            self._send(b'', status=403)
+        elif path == '/v2/api/ts/playlist.m3u8':
+            self._send(b'#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=52973\n/media/chunklist.m3u8\n')
+        elif path == '/media/chunklist.m3u8':
+            lines = ['#EXTM3U'] + [f'#EXTINF:5,\nsegment{i}.aac' for i in range(server.count)] + ['#EXT-X-ENDLIST']
+            self._send('\n'.join(lines).encode())
+        elif path.startswith('/media/segment'):
+            index = int(path[len('/media/segment'):-len('.aac')])
+            with server.lock:
+                server.active += 1
+                server.max_active = max(server.max_active, server.active)
+            # 後ろのセグメントほど早く返して、取得完了順と再生順を変える
+            time.sleep(0.01 * (server.count - index))
+            with server.lock:
+                server.active -= 1
+            if index in server.fail_once:
+                server.fail_once.discard(index)
+                self._send(b'', status=500)
+                return
+            self._send(f'[{index}]'.encode())
+        else:
+            self._send(b'', status=404)
+
+
+class BytesMuxer:
+    def __init__(self, output: Path):
+        self.output = output
+        self.data = b''
+
+    def write(self, data: bytes) -> None:
+        self.data += data
+
+    def close(self) -> None:
+        self.output.write_bytes(self.data)
+
+    def abort(self) -> None:
+        pass
+
+
+class TestHlsDownloader(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeRadikoHandler)
+        self.server.lock = threading.Lock()
+        self.server.count = 12
+        self.server.active = 0
+        self.server.max_active = 0
+        self.server.fail_once = {3}
+        self.server.partial_keys = []
+        self.server.auth_count = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.progress = []
+        self.downloader = HlsDownloader(requests.Session(), f'http://127.0.0.1:{self.server.server_address[1]}',
+                                        workers=4, muxer=BytesMuxer,
+                                        progress=lambda done, total, size: self.progress.append((done, total)))
+
+    def test_segments_fetched_concurrently_and_written_in_order(self):
+        token = self.downloader.authenticate()
+        self.assertEqual(self.server.partial_keys, ['M2MwM2IzNTJlMWVmMmZkNg=='])
+        output = Path(self.tmp.name) / 'out.m4a'
+        self.downloader.download('LFR', '20260328010000', '20260328030000', output, token)
+        self.assertEqual(output.read_text(), ''.join(f'[{i}]' for i in range(12)))
+        self.assertGreater(self.server.max_active, 1)
+        self.assertEqual(self.progress[-1], (12, 12))
+
+    def test_radiko_native_backend(self):
+        r = Radiko(Path('rec.sh'), '', '', Path(self.tmp.name), Path(self.tmp.name) / 'storage', record_backend='native')
+        r.downloader = self.downloader
+        r.auth = RadikoAuth(self.downloader)
+        filepath = r._record_one(make_program(filename='テスト.m4a'))
+        self.assertEqual(filepath.read_text(), ''.join(f'[{i}]' for i in range(12)))
+        r._record_one(make_program(filename='テスト2.m4a'))
+        self.assertEqual(self.server.auth_count, 1)
+
+    def test_auth_token_cached_on_disk(self):
+        cache_file = Path(self.tmp.name) / 'cache' / 'radiko_auth.json'
+        self.assertEqual(RadikoAuth(self.downloader, cache_file=cache_file).token(), 'token')
+        self.assertEqual(cache_file.stat().st_mode & 0o777, 0o600)
+        # 次の実行では保存したトークンを使い、期限が近づいたら取り直す
+        self.assertEqual(RadikoAuth(self.downloader, cache_file=cache_file).token(), 'token')
+        self.assertEqual(self.server.auth_count, 1)
+        RadikoAuth(self.downloader, cache_file=cache_file, refresh_margin=RadikoAuth.TOKEN_TTL).token()
+        self.assertEqual(self.server.auth_count, 2)
+        # 別のアカウントのトークンは使わない
+        with patch.object(self.downloader, 'login', return_value='session'):
+            RadikoAuth(self.downloader, 'a@example.com', 'pw', cache_file=cache_file).token()
+        self.assertEqual(self.server.auth_count, 3)
+
+    def test_rejected_token_is_refreshed(self):
+        cache_file = Path(self.tmp.name) / 'radiko_auth.json'
+        auth = RadikoAuth(self.downloader, cache_file=cache_file)
+        auth.token()
+        auth._token = 'expired'
+        r = Radiko(Path('rec.sh'), '', '', Path(self.tmp.name), Path(self.tmp.name) / 'storage', record_backend='native')
+        r.downloader = self.downloader
+        r.auth = auth
+        filepath = r._record_one(make_program(filename='テスト.m4a'))
+        self.assertEqual(filepath.read_text(), ''.join(f'[{i}]' for i in range(12)))
+        self.assertEqual(self.server.auth_count, 2)
+
+    def test_failed_download_removes_output(self):
+        self.downloader.retries = 0
+        output = Path(self.tmp.name) / 'out.m4a'
+        with self.assertRaises(DownloadError):
+            self.downloader.download('LFR', '20260328010000', '20260328030000', output, 'token')
+        self.assertFalse(output.exists())
+
+
+class TestWriteAtomic(unittest.TestCase):
+    def test_replaces_with_mode_and_leaves_no_temp_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'sub' / 'token.json'
+            path.parent.mkdir()
+            path.write_text('old')
+            path.chmod(0o644)
+            write_atomic(path, '{"token": "新"}', mode=0o600)
+            self.assertEqual(path.read_text(encoding='utf-8'), '{"token": "新"}')
+            self.assertEqual(path.stat().st_mode & 0o777, 0o600)
+            write_atomic(path, b'bytes', mode=0o600)
+            self.assertEqual(path.read_bytes(), b'bytes')
+            self.assertEqual(list(path.parent.iterdir()), [path])
+
+
+class TestFileMover(unittest.TestCase):
+    DATA = b'audio' * 100000
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.src = Path(self.tmp.name) / 'src.m4a'
+        self.src.write_bytes(self.DATA)
+        self.dst = Path(self.tmp.name) / 'storage' / 'a' / 'dst.m4a'
+
+    def _cross_device_replace(self):
+        real_replace = os.replace
+        calls = []
+
+        def replace(src, dst):
+            calls.append(src)
+            if len(calls) == 1:
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            real_replace(src, dst)
+        return replace
+
+    def test_same_filesystem_rename(self):
+        result = FileMover().move(self.src, self.dst)
+        self.assertTrue(result.renamed)
+        self.assertFalse(self.src.exists())
+        self.assertEqual(self.dst.read_bytes(), self.DATA)
+        # rename ではファイルを読み直さない
+        self.assertEqual(result.sha256, '')
+
+    def test_cross_device_copy_with_hash(self):
+        with patch('radiko.file_mover.os.replace', side_effect=self._cross_device_replace()):
+            result = FileMover(fsync=True).move(self.src, self.dst)
+        self.assertFalse(result.renamed)
+        self.assertFalse(self.src.exists())
+        self.assertEqual(self.dst.read_bytes(), self.DATA)
+        self.assertEqual(result.sha256, hashlib.sha256(self.DATA).hexdigest())
+        self.assertEqual([p.name for p in self.dst.parent.iterdir()], ['dst.m4a'])
+
+    def test_cross_device_kernel_copy(self):
+        with patch('radiko.file_mover.os.replace', side_effect=self._cross_device_replace()):
+            result = FileMover(checksum=False).move(self.src, self.dst)
+        self.assertEqual(result.size, len(self.DATA))
+        self.assertEqual(self.dst.read_bytes(), self.DATA)
+
+    def test_failed_copy_leaves_no_partial(self):
+        with patch('radiko.file_mover.os.replace', side_effect=self._cross_device_replace()), \
+             patch.object(FileMover, '_copy_with_hash', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                FileMover().move(self.src, self.dst)
+        self.assertTrue(self.src.exists())
+        self.assertEqual(list(self.dst.parent.iterdir()), [])
+
+
+class TestArtworkCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.session = MagicMock()
+
+    def test_same_image_shared_by_content_hash(self):
+        cache = ArtworkCache(Path(self.tmp.name))
+        self.session.get.return_value = make_response(200, content=b'jpeg')
+        cache.get(self.session, 'http://example.com/a.jpg')
+        cache.get(self.session, 'http://example.com/b.jpg')
+        self.assertEqual(len(list((Path(self.tmp.name) / 'blobs').iterdir())), 1)
+        self.assertEqual(cache.get(self.session, 'http://example.com/a.jpg'), b'jpeg')
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_revalidate_and_fallback(self):
+        cache = ArtworkCache(Path(self.tmp.name), ttl=0)
+        self.session.get.return_value = make_response(200, headers={'ETag': '"x"'}, content=b'jpeg')
+        cache.get(self.session, 'http://example.com/a.jpg')
+        self.session.get.return_value = make_response(304)
+        self.assertEqual(cache.get(self.session, 'http://example.com/a.jpg'), b'jpeg')
+        self.assertEqual(self.session.get.call_args.kwargs['headers']['If-None-Match'], '"x"')
+        self.session.get.side_effect = requests.ConnectionError('down')
+        self.assertEqual(cache.get(self.session, 'http://example.com/a.jpg'), b'jpeg')
+
+    def test_size_bound_evicts_least_recently_used(self):
+        cache = ArtworkCache(Path(self.tmp.name), max_bytes=10)
+        for name in ['a', 'b', 'c']:
+            self.session.get.return_value = make_response(200, content=name.encode() * 4)
+            cache.get(self.session, f'http://example.com/{name}.jpg')
+        self.assertEqual(len(list((Path(self.tmp.name) / 'blobs').iterdir())), 2)
+
+    def test_prefetch_then_get(self):
+        cache = ArtworkCache(Path(self.tmp.name))
+        self.session.get.return_value = make_response(200, content=b'jpeg')
+        cache.prefetch(self.session, ['http://example.com/a.jpg', 'http://example.com/a.jpg'])
+        self.assertEqual(cache.get(self.session, 'http://example.com/a.jpg'), b'jpeg')
+        self.assertEqual(self.session.get.call_count, 1)
+
+    def test_radiko_artwork_failure_does_not_raise(self):
+        r = make_radiko()
+        with patch.object(r.session, 'get', side_effect=requests.ConnectionError('down')):
+            self.assertEqual(r._get_artwork(make_program(img='http://example.com/a.jpg')), b'')
+
+
+class TestAbort(unittest.TestCase):
+    def test_abort_stops_running_and_pending_processes(self):
+        r = make_radiko()
+        results = []
+        thread = threading.Thread(target=lambda: results.append(r._run_process(['sleep', '30'])))
+        started = time.monotonic()
+        thread.start()
+        while not r._procs and time.monotonic() - started < 5:
+            time.sleep(0.01)
+        r.abort()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertNotEqual(results[0], 0)
+        self.assertIsNone(r._run_process(['true']))
+
+    def test_failed_recording_removes_partial_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            r = Radiko(Path('rec.sh'), '', '', Path(tmp), Path(tmp) / 'storage')
+            partial = Path(tmp) / 'テスト.m4a'
+
+            def run_process(param, **kwargs):
+                partial.write_bytes(b'half')
+                return 1
+
+            with patch.object(r, '_run_process', side_effect=run_process):
+                self.assertIsNone(r._rec_radiko_ts_sh(make_program(filename='テスト.m4a')))
+            self.assertFalse(partial.exists())
+
+
+class TestAudioConcatenator(unittest.TestCase):
+    def test_single_pass_command(self):
+        ac = AudioConcatenator(Path('out.m4a'))
+        ac.set_metadata(album='アルバム', title='2026-03-28', artist='')
+        ac.set_cover(b'\x89PNG....')
+        command = ac._command(Path('list.txt'), Path('cover.png'))
+        self.assertEqual(command[:6], ['ffmpeg', '-f', 'concat', '-safe', '0', '-i'])
+        self.assertIn('attached_pic', command)
+        self.assertIn('album=アルバム', command)
+        self.assertNotIn('artist=', command)
+        self.assertEqual(command[-3:], ['-movflags', '+faststart', Path('out.m4a')])
+        self.assertEqual(ac._cover_suffix(), '.png')
+
+    def test_without_cover_copies_streams_only(self):
+        ac = AudioConcatenator(Path('out.m4a'), faststart=False)
+        self.assertEqual(ac._command(Path('list.txt'), None),
+                         ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', Path('list.txt'), '-c', 'copy', Path('out.m4a')])
+
+
 if __name__ == '__main__':
     unittest.main()
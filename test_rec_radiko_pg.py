@@ -0,0 +1,58 @@
+import unittest
+from datetime import datetime
+from benchmarks.import_time import LAZY_MODULES, measure
+from rec_radiko_pg import next_recordable_at, plan_window, status_window
+from test_radiko import make_program
+
+
+class FakeLatest:
+    def __init__(self, last: str = ''):
+        self.last = last
+
+    def get(self, program):
+        return self.last
+
+
+class TestImport(unittest.TestCase):
+    def test_lazy_modules_not_imported_at_startup(self):
+        _, _, modules = measure(runs=1)
+        loaded = [m for m in modules if any(m == lazy or m.startswith(lazy + '.') for lazy in LAZY_MODULES)]
+        self.assertEqual(loaded, [])
+
+
+class TestPlanWindow(unittest.TestCase):
+    def test_record_window_covers_timefree_retention(self):
+        n = datetime(2026, 3, 28, 10, 30)
+        self.assertEqual(plan_window(n, False, 7, None), ('20260321000000', '20260329000000'))
+
+    def test_since_narrows_window(self):
+        n = datetime(2026, 3, 28, 10, 30)
+        self.assertEqual(plan_window(n, False, 7, '20260327103000'), ('20260327000000', '20260329000000'))
+
+    def test_list_window(self):
+        n = datetime(2026, 3, 28, 10, 30)
+        self.assertEqual(plan_window(n, True, 3, None), ('20260328000000', '20260401000000'))
+
+    def test_status_window_includes_tomorrow(self):
+        n = datetime(2026, 3, 28, 23, 30)
+        self.assertEqual(status_window(n), ('20260321000000', '20260330000000'))
+
+
+class TestNextRecordableAt(unittest.TestCase):
+    def test_earliest_unrecorded_program_end_plus_five_minutes(self):
+        programs = {
+            'a': make_program(start_time='20260328100000', end_time='20260328120000'),
+            'b': [make_program(start_time='20260328130000', end_time='20260328140000'),
+                  make_program(start_time='20260328140000', end_time='20260328150000')],
+        }
+        n = datetime(2026, 3, 28, 12, 30)
+        self.assertEqual(next_recordable_at(programs, FakeLatest(), n), datetime(2026, 3, 28, 15, 5))
+
+    def test_recorded_programs_skipped(self):
+        programs = {'a': make_program(start_time='20260328100000', end_time='20260328120000')}
+        n = datetime(2026, 3, 28, 9, 0)
+        self.assertIsNone(next_recordable_at(programs, FakeLatest('20260328100000'), n))
+
+
+if __name__ == '__main__':
+    unittest.main()